@@ -7,14 +7,15 @@ from .models import Account, UserProfile
 from django.contrib import auth, messages
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse
-from carts.models import Cart, CartItem
-from carts.views import _cart_id
+from carts.mutations import merge_guest_cart, merge_session_cart
+from carts.views import _clear_cart_count
 from orders.models import Order, OrderProduct
+from orders.invoices import get_invoice, invoice_response
+from orders.pdf import PDFRenderTimeout
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth.forms import PasswordChangeForm
 from django.conf import settings
 from django.http import HttpResponse
-from weasyprint import HTML
 
 # Varification email
 from django.contrib.sites.shortcuts import get_current_site
@@ -27,7 +28,7 @@ from django.core.mail import EmailMessage
 # Create your views here.
 def home(request):
     banners = Banner.objects.filter(is_active=True)
-    products = Product.objects.all().filter(is_available=True)
+    products = Product.objects.all().filter(is_available=True).select_related('category')
     context = {
         'banners': banners,
         'products': products,
@@ -89,43 +90,14 @@ def login(request):
         user = auth.authenticate(email=email, password=password)
 
         if user is not None:
-            try:
-                # Find Session cart 
-                cart = Cart.objects.get(cart_id=_cart_id(request))
-                # Session cart all items (Guest Cart)
-                session_cart_items = CartItem.objects.filter(cart=cart)
-                
-                # Login user existing items (User Cart)
-                user_cart_items = CartItem.objects.filter(user=user)
-                
-                ex_var_list = []
-                id_list = []
-                for item in user_cart_items:
-                    existing_variation = list(item.variations.all())
-                    ex_var_list.append(existing_variation)
-                    id_list.append(item.id)
-
-                for item in session_cart_items:
-                    current_variation = list(item.variations.all())
-                    
-                    if current_variation in ex_var_list:
-                        # if variation match then add quantity 
-                        index = ex_var_list.index(current_variation)
-                        item_id = id_list[index]
-                        cart_item = CartItem.objects.get(id=item_id)
-                        cart_item.quantity += item.quantity # Add Session quantity 
-                        cart_item.user = user
-                        cart_item.save()
-                        item.delete() # Delete Session item  
-                    else:
-                        # if variation Not match then new item to joined user 
-                        item.user = user
-                        item.save()
-                        
-            except Cart.DoesNotExist:
-                pass
+            # Guest cart joins the user's cart before the session key changes
+            if request.session.session_key:
+                merge_guest_cart(request.session.session_key, user)
+                merge_session_cart(request.session, user)
 
             auth.login(request, user)
+            # The badge now has to count the user's merged cart
+            _clear_cart_count(request)
             messages.success(request, 'You are now logged in.')
 
             url = request.META.get('HTTP_REFERER')
@@ -302,22 +274,14 @@ def order_detail(request, order_id):
     except (Order.DoesNotExist):
         return redirect('dashboard')
     
+@login_required(login_url='login')
 def generate_pdf_invoice(request, order_id):
-    order = Order.objects.get(order_number=order_id, is_ordered=True)
-    order_details = OrderProduct.objects.filter(order_id=order.id)
-    subtotal = sum(item.product_price * item.quantity for item in order_details)
-    
-    context = {
-        'order': order,
-        'order_details': order_details,
-        'subtotal': subtotal,
-    }
-    
-    html_string = render_to_string('accounts/invoice_pdf.html', context)
-    
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="Invoice_{order.order_number}.pdf"'
-
-    HTML(string=html_string, base_url=request.build_absolute_uri()).write_pdf(response)
-    
-    return response
+    order = get_object_or_404(Order, order_number=order_id, is_ordered=True, user=request.user)
+    # Rendered on the first download (or by the confirmation email), a file read after that
+    try:
+        name, digest = get_invoice(order, request.build_absolute_uri())
+    except PDFRenderTimeout:
+        response = HttpResponse('The invoice is taking longer than usual, please try again shortly.', status=503)
+        response['Retry-After'] = 30
+        return response
+    return invoice_response(request, order, name, digest)
@@ -0,0 +1,56 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from .models import Cart, CartItem
+
+# Session engines that keep their sessions in django_session
+DB_SESSION_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+def db_sessions():
+    return settings.SESSION_ENGINE in DB_SESSION_ENGINES
+
+def abandoned_carts(max_age_days, now=None):
+    # Guest carts older than max_age_days or whose session is gone. With a session
+    # engine outside the database only the age can be checked.
+    now = now or timezone.now()
+    abandoned = Q(date_added__lt=(now - timedelta(days=max_age_days)).date())
+    if db_sessions():
+        live = Session.objects.filter(session_key=OuterRef('cart_id'), expire_date__gt=now)
+        abandoned |= ~Exists(live)
+    return Cart.objects.filter(abandoned)
+
+def _batches(queryset, batch_size, pause):
+    # Primary keys batch by batch, each batch is deleted before the next is read
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        yield ids
+        if pause:
+            time.sleep(pause)
+
+def clear_carts(max_age_days, batch_size=500, pause=0):
+    # Returns (carts, cart lines) removed, one short transaction per batch
+    carts = lines = 0
+    for ids in _batches(abandoned_carts(max_age_days), batch_size, pause):
+        with transaction.atomic():
+            # Lines merged into a user's cart at login still point at the guest cart
+            CartItem.objects.filter(cart__in=ids, user__isnull=False).update(cart=None)
+            lines += CartItem.objects.filter(cart__in=ids).delete()[1].get(CartItem._meta.label, 0)
+            carts += Cart.objects.filter(pk__in=ids).delete()[0]
+    return carts, lines
+
+def clear_sessions(batch_size=500, pause=0):
+    if not db_sessions():
+        return 0
+    removed = 0
+    for keys in _batches(Session.objects.filter(expire_date__lte=timezone.now()), batch_size, pause):
+        removed += Session.objects.filter(pk__in=keys).delete()[0]
+    return removed
@@ -0,0 +1,100 @@
+from django.conf import settings
+from store.models import Product, Variation, variation_signature
+
+# Session key holding an anonymous visitor's cart when CART_STORAGE = 'session'
+GUEST_CART_SESSION_KEY = 'guest_cart'
+
+def session_storage(request):
+    # Guests keep their cart in the session, nothing is written to Cart/CartItem
+    # until they log in (see accounts.views.login)
+    return getattr(settings, 'CART_STORAGE', 'db') == 'session' and not request.user.is_authenticated
+
+class VariationList(list):
+    # Answers cart_item.variations.all in the templates
+    def all(self):
+        return self
+
+class GuestLine:
+    # A session cart line, shaped like a CartItem for the cart templates
+    def __init__(self, line_id, product, variations, quantity, signature=''):
+        self.id = line_id
+        self.product = product
+        self.variations = VariationList(variations)
+        self.variation_signature = signature
+        self.quantity = quantity
+        self.line_total = product.price * quantity
+
+    def sub_total(self):
+        return self.line_total
+
+class SessionCart:
+    # {'next': 3, 'lines': {'1': {'product': 7, 'variations': [2, 5], 'signature': '...', 'quantity': 1}}}
+    def __init__(self, session):
+        self.session = session
+        self.data = session.get(GUEST_CART_SESSION_KEY) or {'next': 1, 'lines': {}}
+
+    def save(self):
+        self.session[GUEST_CART_SESSION_KEY] = self.data
+        self.session.modified = True
+
+    def add(self, product_id, variation_ids=(), quantity=1):
+        signature = variation_signature(variation_ids)
+        for line in self.data['lines'].values():
+            if line['product'] == product_id and line['signature'] == signature:
+                line['quantity'] += quantity
+                break
+        else:
+            self.data['lines'][str(self.data['next'])] = {
+                'product': product_id, 'variations': sorted(variation_ids),
+                'signature': signature, 'quantity': quantity,
+            }
+            self.data['next'] += 1
+        self.save()
+
+    def _line(self, product_id, line_id):
+        line = self.data['lines'].get(str(line_id))
+        return line if line and line['product'] == product_id else None
+
+    def increment(self, product_id, line_id):
+        line = self._line(product_id, line_id)
+        if line is not None:
+            line['quantity'] += 1
+            self.save()
+
+    def decrement(self, product_id, line_id):
+        line = self._line(product_id, line_id)
+        if line is None:
+            return
+        if line['quantity'] > 1:
+            line['quantity'] -= 1
+        else:
+            del self.data['lines'][str(line_id)]
+        self.save()
+
+    def remove(self, product_id, line_id):
+        if self._line(product_id, line_id) is not None:
+            del self.data['lines'][str(line_id)]
+            self.save()
+
+    def clear(self):
+        self.session.pop(GUEST_CART_SESSION_KEY, None)
+
+    def quantity(self):
+        return sum(line['quantity'] for line in self.data['lines'].values())
+
+    def lines(self):
+        # Two queries whatever the size, lines of deleted products are left out
+        entries = sorted(self.data['lines'].items(), key=lambda entry: int(entry[0]))
+        if not entries:
+            return []
+        products = Product.objects.in_bulk({line['product'] for _, line in entries})
+        variation_ids = {pk for _, line in entries for pk in line['variations']}
+        variations = Variation.objects.in_bulk(variation_ids) if variation_ids else {}
+        return [
+            GuestLine(
+                int(line_id), products[line['product']],
+                [variations[pk] for pk in line['variations'] if pk in variations], line['quantity'],
+                line['signature'],
+            )
+            for line_id, line in entries if line['product'] in products
+        ]
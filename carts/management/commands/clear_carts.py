@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from carts.cleanup import clear_carts, clear_sessions
+
+class Command(BaseCommand):
+    help = 'Delete abandoned guest carts and expired sessions in small batches, safe to run on a live site'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Also delete guest carts older than this (default 30)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows deleted per transaction (default 500)')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        carts, lines = clear_carts(options['days'], options['batch_size'], options['sleep'])
+        sessions = clear_sessions(options['batch_size'], options['sleep'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Removed {carts} cart(s), {lines} cart line(s) and {sessions} expired session(s) '
+            f'in {time.monotonic() - started:.2f}s.'
+        ))
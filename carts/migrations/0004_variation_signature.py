@@ -0,0 +1,50 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:26
+
+import hashlib
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_signatures(apps, schema_editor):
+    # Sign existing lines and fold duplicates into the first one before the constraint lands
+    CartItem = apps.get_model('carts', 'CartItem')
+    seen = {}
+    for item in CartItem.objects.prefetch_related('variations').order_by('id'):
+        ids = sorted({v.pk for v in item.variations.all()})
+        item.variation_signature = hashlib.sha1(','.join(map(str, ids)).encode()).hexdigest() if ids else ''
+        key = (item.user_id, None if item.user_id else item.cart_id, item.product_id, item.variation_signature)
+        if key in seen:
+            first = seen[key]
+            first.quantity += item.quantity
+            first.save(update_fields=['quantity'])
+            item.delete()
+        else:
+            item.save(update_fields=['variation_signature'])
+            seen[key] = item
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0003_cartitem_user_alter_cartitem_cart'),
+        ('store', '0008_product_url_path'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='variation_signature',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.RunPython(fill_signatures, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('user', 'product', 'variation_signature'), name='unique_user_cart_line'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('cart', 'product', 'variation_signature'), name='unique_guest_cart_line'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    # Fold carts sharing a cart_id into the oldest one, merging matching lines
+    Cart = apps.get_model('carts', 'Cart')
+    CartItem = apps.get_model('carts', 'CartItem')
+    keep = {}
+    for cart in Cart.objects.order_by('id'):
+        if cart.cart_id not in keep:
+            keep[cart.cart_id] = cart
+            continue
+        target = keep[cart.cart_id]
+        for item in CartItem.objects.filter(cart=cart):
+            match = CartItem.objects.filter(
+                cart=target, user=None, product_id=item.product_id,
+                variation_signature=item.variation_signature,
+            ).first()
+            if item.user_id is None and match:
+                match.quantity += item.quantity
+                match.save(update_fields=['quantity'])
+                item.delete()
+            else:
+                item.cart = target
+                item.save(update_fields=['cart'])
+        cart.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0004_variation_signature'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='cart',
+            name='cart_id',
+            field=models.CharField(blank=True, max_length=250, unique=True),
+        ),
+    ]
@@ -4,7 +4,7 @@ from accounts.models import Account
 
 # Create your models here.
 class Cart(models.Model):
-    cart_id = models.CharField(max_length=250, blank=True)
+    cart_id = models.CharField(max_length=250, blank=True, unique=True)
     date_added = models.DateField(auto_now_add=True)
 
     def __str__(self):
@@ -17,8 +17,27 @@ class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, null=True)
     quantity = models.IntegerField()
     is_active = models.BooleanField(default=True)
+    # store.models.variation_signature() of the variations
+    variation_signature = models.CharField(max_length=40, blank=True, default='')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'product', 'variation_signature'],
+                condition=models.Q(user__isnull=False),
+                name='unique_user_cart_line',
+            ),
+            models.UniqueConstraint(
+                fields=['cart', 'product', 'variation_signature'],
+                condition=models.Q(user__isnull=True),
+                name='unique_guest_cart_line',
+            ),
+        ]
 
     def sub_total(self):
+        # CartSummary computes it in the query
+        if hasattr(self, 'line_total'):
+            return self.line_total
         return self.product.price * self.quantity
         
     def __unicode__(self):
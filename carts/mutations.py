@@ -0,0 +1,124 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from store.models import variation_signature
+from .models import Cart, CartItem
+from .guest import SessionCart
+
+# Every cart write goes through here: single-statement F() updates and
+# inserts guarded by the unique cart line constraints, so concurrent
+# requests never lose an increment or create a duplicate line.
+
+def get_cart(cart_id):
+    try:
+        cart, _ = Cart.objects.get_or_create(cart_id=cart_id)
+    except IntegrityError:
+        # Created by a parallel request between our lookup and insert
+        cart = Cart.objects.get(cart_id=cart_id)
+    return cart
+
+def add_item(product, variation_ids=(), user=None, cart=None, quantity=1, attempts=3):
+    # Add quantity to the user's (or guest cart's) line with exactly these variations
+    owner = {'user': user} if user is not None else {'cart': cart, 'user': None}
+    signature = variation_signature(variation_ids)
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                lines = CartItem.objects.filter(product=product, variation_signature=signature, **owner)
+                if lines.update(quantity=F('quantity') + quantity):
+                    return
+                item = CartItem.objects.create(
+                    product=product, variation_signature=signature, quantity=quantity, **owner
+                )
+                if variation_ids:
+                    item.variations.add(*variation_ids)
+                return
+        except IntegrityError:
+            # A parallel request created the line first, go round and increment it
+            if attempt == attempts - 1:
+                raise
+
+def increment_item(cart_items):
+    # cart_items is a queryset narrowed to one line
+    cart_items.update(quantity=F('quantity') + 1)
+
+def decrement_item(cart_items):
+    # cart_items is a queryset narrowed to one line: take one off, drop the line at zero
+    with transaction.atomic():
+        if not cart_items.filter(quantity__gt=1).update(quantity=F('quantity') - 1):
+            cart_items.delete()
+
+def remove_item(cart_items):
+    cart_items.delete()
+
+def merge_guest_cart(cart_id, user):
+    # Move a guest cart into the user's cart at login: one read, one bulk_update for
+    # lines both carts share, one UPDATE for the rest and one DELETE, in one transaction
+    with transaction.atomic():
+        items = list(
+            CartItem.objects.select_for_update()
+            .filter(Q(cart__cart_id=cart_id, user=None) | Q(user=user))
+            .only('id', 'user_id', 'product_id', 'variation_signature', 'quantity')
+        )
+        user_lines = {(i.product_id, i.variation_signature): i for i in items if i.user_id == user.pk}
+
+        merged, moved, absorbed = [], [], []
+        for item in items:
+            if item.user_id is not None:
+                continue
+            line = user_lines.get((item.product_id, item.variation_signature))
+            if line:
+                line.quantity += item.quantity
+                merged.append(line)
+                absorbed.append(item.pk)
+            else:
+                moved.append(item.pk)
+
+        if merged:
+            CartItem.objects.bulk_update(merged, ['quantity'])
+        if moved:
+            CartItem.objects.filter(pk__in=moved).update(user=user)
+        if absorbed:
+            CartItem.objects.filter(pk__in=absorbed).delete()
+    return len(merged) + len(moved)
+
+def merge_session_cart(session, user):
+    # Materialize a session guest cart (CART_STORAGE = 'session') into the user's cart
+    # at login: one read, one bulk_update, one bulk_create for lines and one for variations
+    guest_cart = SessionCart(session)
+    lines = guest_cart.lines()
+    if not lines:
+        return 0
+    try:
+        with transaction.atomic():
+            user_lines = {
+                (i.product_id, i.variation_signature): i
+                for i in CartItem.objects.select_for_update()
+                .filter(user=user, product__in=[line.product for line in lines])
+                .only('id', 'product_id', 'variation_signature', 'quantity')
+            }
+            merged, created = [], []
+            for line in lines:
+                signature = variation_signature(line.variations)
+                item = user_lines.get((line.product.pk, signature))
+                if item:
+                    item.quantity += line.quantity
+                    merged.append(item)
+                else:
+                    item = CartItem(user=user, product=line.product, variation_signature=signature, quantity=line.quantity)
+                    created.append((item, line.variations))
+
+            if merged:
+                CartItem.objects.bulk_update(merged, ['quantity'])
+            if created:
+                CartItem.objects.bulk_create([item for item, _ in created])
+                Through = CartItem.variations.through
+                Through.objects.bulk_create([
+                    Through(cartitem_id=item.pk, variation_id=variation.pk)
+                    for item, variations in created for variation in variations
+                ])
+    except IntegrityError:
+        # A parallel request added one of the lines, fall back to line by line
+        for line in lines:
+            add_item(line.product, [v.pk for v in line.variations], user=user, quantity=line.quantity)
+    guest_cart.clear()
+    return len(lines)
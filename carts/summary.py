@@ -0,0 +1,57 @@
+from django.db.models import F
+from .guest import SessionCart, session_storage
+from .models import CartItem
+
+# Percentage added on top of the cart total
+TAX_RATE = 2
+
+def cart_items_for(request):
+    # The visitor's cart lines: the user's, or the guest lines of this session
+    if request.user.is_authenticated:
+        return CartItem.objects.filter(user=request.user)
+    if request.session.session_key:
+        return CartItem.objects.filter(cart__cart_id=request.session.session_key, user=None)
+    return CartItem.objects.none()
+
+def load_cart_items(cart_items):
+    # A single query plus the variations prefetch, line totals computed by the database
+    return list(
+        cart_items.select_related('product')
+        .prefetch_related('variations')
+        .annotate(line_total=F('product__price') * F('quantity'))
+        .order_by('id')
+    )
+
+class CartSummary:
+    # Lines and totals of one cart, CartItems or session GuestLines
+    def __init__(self, cart_items):
+        self.cart_items = cart_items
+        self.total = sum(item.line_total for item in self.cart_items)
+        self.quantity = sum(item.quantity for item in self.cart_items)
+        self.tax = (TAX_RATE * self.total)/100
+        self.grand_total = self.total + self.tax
+
+    @classmethod
+    def for_request(cls, request):
+        # Built once per request and shared by views, templates and context processors
+        summary = getattr(request, '_cart_summary', None)
+        if summary is None:
+            if session_storage(request):
+                cart_items = SessionCart(request.session).lines()
+            else:
+                cart_items = load_cart_items(cart_items_for(request))
+            summary = request._cart_summary = cls(cart_items)
+        return summary
+
+    def __len__(self):
+        return len(self.cart_items)
+
+    def context(self):
+        return {
+            'total': self.total,
+            'quantity': self.quantity,
+            'cart_items': self.cart_items,
+            'tax': self.tax,
+            'grand_total': self.grand_total,
+            'cart_summary': self,
+        }
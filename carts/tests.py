@@ -1,3 +1,354 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from io import StringIO
+from urllib.error import HTTPError
+from urllib.request import HTTPRedirectHandler, build_opener
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import LiveServerTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from greatkart.testing import create_customer, without_session_timeout
+from category.models import Category
+from store.models import Product, Variation, variation_signature
+from store.variations import InvalidVariation, resolve_variations, variation_map_key
+from .models import Cart, CartItem
+from .mutations import add_item, get_cart, merge_guest_cart
 
 # Create your tests here.
+class NoRedirect(HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+class CartTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(category_name='Shirts', slug='shirts')
+        self.product = self.create_product('Blue Shirt')
+        self.user = create_customer()
+
+    def create_product(self, name, stock=5):
+        return Product.objects.create(
+            product_name=name, slug=name.lower().replace(' ', '-'), price=100,
+            images='photos/products/test.jpg', stock=stock, category=self.category,
+        )
+
+    def cart_count(self):
+        return self.client.get(reverse('home')).context['cart_count']
+
+class CartCounterTest(CartTestCase):
+    def test_badge_follows_cart_changes(self):
+        self.assertEqual(self.cart_count(), 0)
+        self.client.get(reverse('add_cart', args=[self.product.id]))
+        self.client.get(reverse('add_cart', args=[self.product.id]))
+        self.assertEqual(self.cart_count(), 2)
+
+        item = CartItem.objects.get()
+        self.client.get(reverse('remove_cart_item', args=[self.product.id, item.id]))
+        self.assertEqual(self.cart_count(), 0)
+
+    def test_badge_is_served_from_session(self):
+        self.client.get(reverse('add_cart', args=[self.product.id]))
+        self.cart_count()
+        CartItem.objects.update(quantity=5)
+        self.assertEqual(self.cart_count(), 1)
+
+    def test_anonymous_browsing_creates_no_session(self):
+        for _ in range(3):
+            self.assertEqual(self.cart_count(), 0)
+            self.client.get(reverse('store'))
+        self.assertFalse(Session.objects.exists())
+
+    def test_login_counts_merged_cart(self):
+        CartItem.objects.create(user=self.user, product=self.create_product('Red Shirt'), quantity=2)
+        self.client.get(reverse('add_cart', args=[self.product.id]))
+        self.assertEqual(self.cart_count(), 1)
+        self.client.post(reverse('login'), {'email': 'john@example.com', 'password': 'secret'})
+        self.assertEqual(self.cart_count(), 3)
+
+class VariationSignatureTest(CartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.blue = Variation.objects.create(product=self.product, variation_category='color', variation_value='Blue')
+        self.red = Variation.objects.create(product=self.product, variation_category='color', variation_value='Red')
+        self.large = Variation.objects.create(product=self.product, variation_category='size', variation_value='L')
+
+    def add(self, **variations):
+        self.client.post(reverse('add_cart', args=[self.product.id]), variations)
+
+    def test_signature_ignores_order(self):
+        self.assertEqual(variation_signature([self.blue, self.large]), variation_signature([self.large.pk, self.blue.pk]))
+        self.assertEqual(variation_signature([]), '')
+
+    def test_same_variations_share_a_line(self):
+        self.add(color='blue', size='l')
+        self.add(size='L', color='Blue')
+        self.add(color='red', size='l')
+        lines = {item.variation_signature: item.quantity for item in CartItem.objects.all()}
+        self.assertEqual(lines, {
+            variation_signature([self.blue, self.large]): 2,
+            variation_signature([self.red, self.large]): 1,
+        })
+
+    def test_login_merges_matching_lines(self):
+        item = CartItem.objects.create(
+            user=self.user, product=self.product, quantity=2,
+            variation_signature=variation_signature([self.blue]),
+        )
+        item.variations.add(self.blue)
+        self.add(color='blue')
+        self.add(color='red')
+        self.client.post(reverse('login'), {'email': 'john@example.com', 'password': 'secret'})
+        lines = {item.variation_signature: item.quantity for item in CartItem.objects.filter(user=self.user)}
+        self.assertEqual(lines, {variation_signature([self.blue]): 3, variation_signature([self.red]): 1})
+
+    def test_unknown_variation_is_rejected(self):
+        response = self.client.post(
+            reverse('add_cart', args=[self.product.id]), {'color': 'green'}, HTTP_REFERER=self.product.get_url(),
+        )
+        self.assertRedirects(response, self.product.get_url(), fetch_redirect_response=False)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_variations_resolve_from_cache(self):
+        resolve_variations(self.product.id, {'color': 'Blue'})
+        with self.assertNumQueries(0):
+            ids = resolve_variations(self.product.id, {'csrfmiddlewaretoken': 'x', 'color': 'blue', 'size': 'l'})
+        self.assertEqual(ids, [self.blue.id, self.large.id])
+
+        self.red.variation_value = 'Green'
+        self.red.save()
+        self.assertEqual(resolve_variations(self.product.id, {'color': 'green'}), [self.red.id])
+
+    def test_committed_change_clears_the_shared_map(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.large.is_active = False
+            self.large.save()
+            # Another process caching the old rows before the commit
+            cache.set(variation_map_key(self.product.id), {('size', 'l'): self.large.id})
+        with self.assertRaises(InvalidVariation):
+            resolve_variations(self.product.id, {'size': 'l'})
+
+class ConcurrentAddTest(LiveServerTestCase):
+    # Parallel add_cart requests against the threaded live server must not lose increments
+    clicks = 10
+
+    def setUp(self):
+        category = Category.objects.create(category_name='Shirts', slug='shirts')
+        self.product = Product.objects.create(
+            product_name='Blue Shirt', slug='blue-shirt', price=100,
+            images='photos/products/test.jpg', stock=5, category=category,
+        )
+        self.user = create_customer()
+
+    def fire(self, cookie):
+        url = self.live_server_url + reverse('add_cart', args=[self.product.id])
+        opener = build_opener(NoRedirect)
+        opener.addheaders = [('Cookie', cookie)]
+        barrier = threading.Barrier(self.clicks)
+        errors = []
+
+        def click():
+            barrier.wait()
+            try:
+                opener.open(url).close()
+            except HTTPError as e:
+                if e.code != 302:
+                    errors.append(e)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=click) for _ in range(self.clicks)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_parallel_adds_for_a_user(self):
+        self.client.force_login(self.user)
+        self.fire(f'sessionid={self.client.cookies["sessionid"].value}')
+        self.assertEqual(CartItem.objects.get(user=self.user).quantity, self.clicks)
+
+    def test_parallel_adds_for_a_guest(self):
+        session = SessionStore()
+        session.create()
+        self.fire(f'sessionid={session.session_key}')
+        item = CartItem.objects.get(cart__cart_id=session.session_key)
+        self.assertEqual(item.quantity, self.clicks)
+
+class MergeGuestCartTest(CartTestCase):
+    def fill_guest_cart(self, size):
+        cart = get_cart('guest-session')
+        for i in range(size):
+            product = self.create_product(f'Product {size}-{i}')
+            add_item(product, cart=cart, quantity=2)
+            if i % 2:
+                add_item(product, user=self.user)
+        return cart
+
+    def merge_queries(self, size):
+        self.fill_guest_cart(size)
+        with CaptureQueriesContext(connection) as queries:
+            merge_guest_cart('guest-session', self.user)
+        return len(queries)
+
+    def test_merges_matching_lines_and_moves_the_rest(self):
+        self.fill_guest_cart(4)
+        merge_guest_cart('guest-session', self.user)
+        quantities = sorted(CartItem.objects.filter(user=self.user).values_list('quantity', flat=True))
+        self.assertEqual(quantities, [2, 2, 3, 3])
+        self.assertEqual(CartItem.objects.count(), 4)
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        small = self.merge_queries(2)
+        CartItem.objects.all().delete()
+        self.assertEqual(self.merge_queries(12), small)
+
+class CartSummaryTest(CartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def cart_page_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('cart'))
+        return len(queries), response
+
+    def test_totals(self):
+        add_item(self.product, user=self.user, quantity=2)
+        add_item(self.create_product('Red Shirt'), user=self.user)
+        response = self.client.get(reverse('checkout'))
+        self.assertEqual(response.context['total'], 300)
+        self.assertEqual(response.context['quantity'], 3)
+        self.assertEqual(response.context['tax'], 6)
+        self.assertEqual(response.context['grand_total'], 306)
+        self.assertContains(response, '$200')
+
+    def test_empty_cart_place_order_redirects(self):
+        response = self.client.post(reverse('place_order'))
+        self.assertRedirects(response, reverse('store'), fetch_redirect_response=False)
+
+    @without_session_timeout
+    def test_query_count_does_not_grow_with_cart_size(self):
+        add_item(self.product, user=self.user)
+        self.client.get(reverse('cart'))
+        small, _ = self.cart_page_queries()
+        for i in range(8):
+            add_item(self.create_product(f'Shirt {i}'), user=self.user)
+        large, response = self.cart_page_queries()
+        self.assertEqual(len(response.context['cart_items']), 9)
+        self.assertEqual(large, small)
+
+@override_settings(CART_STORAGE='session')
+class SessionCartTest(CartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.blue = Variation.objects.create(product=self.product, variation_category='color', variation_value='Blue')
+
+    def add(self, product, **variations):
+        return self.client.post(reverse('add_cart', args=[product.id]), variations)
+
+    def test_guest_cart_writes_no_rows(self):
+        self.add(self.product, color='blue')
+        self.add(self.product, color='blue')
+        self.add(self.product)
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+
+        response = self.client.get(reverse('cart'))
+        self.assertEqual([line.quantity for line in response.context['cart_items']], [2, 1])
+        self.assertEqual(response.context['total'], 300)
+        self.assertEqual(response.context['cart_count'], 3)
+        self.assertContains(response, 'value="blue"')
+
+    def test_remove_lines(self):
+        self.add(self.product, color='blue')
+        self.add(self.product, color='blue')
+        line = self.client.get(reverse('cart')).context['cart_items'][0]
+        self.client.get(reverse('remove_cart', args=[self.product.id, line.id]))
+        self.assertEqual(self.cart_count(), 1)
+        self.client.get(reverse('remove_cart_item', args=[self.product.id, line.id]))
+        self.assertEqual(self.cart_count(), 0)
+
+    def test_login_materializes_the_cart(self):
+        add_item(self.product, [self.blue.id], user=self.user)
+        self.add(self.product, color='blue')
+        self.add(self.create_product('Red Shirt'))
+        self.client.post(reverse('login'), {'email': 'john@example.com', 'password': 'secret'})
+
+        lines = CartItem.objects.filter(user=self.user).order_by('id')
+        self.assertEqual([line.quantity for line in lines], [2, 1])
+        self.assertEqual(list(lines[0].variations.all()), [self.blue])
+        self.assertEqual(self.cart_count(), 3)
+        self.assertFalse(Cart.objects.exists())
+
+class ClearCartsTest(CartTestCase):
+    def guest_cart(self, session_key, age_days=0):
+        cart = get_cart(session_key)
+        add_item(self.product, cart=cart)
+        Cart.objects.filter(pk=cart.pk).update(date_added=timezone.now().date() - timedelta(days=age_days))
+        return cart
+
+    def live_session(self):
+        session = SessionStore()
+        session.create()
+        return session.session_key
+
+    def test_removes_expired_and_old_carts_in_batches(self):
+        kept = self.guest_cart(self.live_session())
+        self.guest_cart('expired-session')
+        self.guest_cart(self.live_session(), age_days=60)
+        merged = self.guest_cart('merged-session')
+        merge_guest_cart('merged-session', self.user)
+        Session.objects.create(session_key='stale', session_data='', expire_date=timezone.now() - timedelta(days=1))
+
+        out = StringIO()
+        call_command('clear_carts', '--days=30', '--batch-size=1', stdout=out)
+        self.assertIn('Removed 3 cart(s), 2 cart line(s) and 1 expired session(s)', out.getvalue())
+        self.assertEqual(list(Cart.objects.all()), [kept])
+        # The user's line survives its guest cart
+        self.assertEqual(CartItem.objects.filter(user=self.user, cart=None).count(), 1)
+        self.assertFalse(Cart.objects.filter(pk=merged.pk).exists())
+
+class CartJsonTest(CartTestCase):
+    def setUp(self):
+        super().setUp()
+        Variation.objects.create(product=self.product, variation_category='color', variation_value='Blue')
+
+    def post(self, name, *args, **data):
+        response = self.client.post(reverse(name, args=args), data)
+        return response.status_code, response.json()
+
+    def test_add_increment_decrement_remove(self):
+        status, data = self.post('add_cart_json', self.product.id, color='blue')
+        self.assertEqual(status, 200)
+        line = data['line']
+        self.assertEqual((line['quantity'], line['sub_total']), (1, 100))
+        self.assertEqual(data['cart'], {'count': 1, 'total': 100, 'tax': 2.0, 'grand_total': 102.0})
+
+        _, data = self.post('increment_cart_json', self.product.id, line['id'])
+        self.assertEqual((data['line']['quantity'], data['cart']['count']), (2, 2))
+        _, data = self.post('decrement_cart_json', self.product.id, line['id'])
+        self.assertEqual(data['line']['quantity'], 1)
+        _, data = self.post('remove_cart_json', self.product.id, line['id'])
+        self.assertIsNone(data['line'])
+        self.assertEqual(data['cart']['count'], 0)
+        self.assertEqual(self.cart_count(), 0)
+
+    @override_settings(CART_STORAGE='session')
+    def test_session_cart(self):
+        _, data = self.post('add_cart_json', self.product.id, color='blue')
+        _, data = self.post('increment_cart_json', self.product.id, data['line']['id'])
+        self.assertEqual(data['line']['quantity'], 2)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_invalid_variation_and_get(self):
+        status, data = self.post('add_cart_json', self.product.id, color='green')
+        self.assertEqual(status, 400)
+        self.assertIn('color: green', data['error'])
+        response = self.client.get(reverse('add_cart_json', args=[self.product.id]))
+        self.assertEqual(response.status_code, 405)
@@ -7,4 +7,10 @@ urlpatterns = [
     path('remove_cart/<int:product_id>/<int:cart_item_id>/', views.remove_cart, name='remove_cart'),
     path('remove_cart_item/<int:product_id>/<int:cart_item_id>/', views.remove_cart_item, name='remove_cart_item'),
     path('checkout/', views.checkout,name='checkout'),
+
+    # JSON versions for updating the page in place
+    path('api/add/<int:product_id>/', views.add_cart_json, name='add_cart_json'),
+    path('api/increment/<int:product_id>/<int:cart_item_id>/', views.change_cart_json, {'action': 'increment'}, name='increment_cart_json'),
+    path('api/decrement/<int:product_id>/<int:cart_item_id>/', views.change_cart_json, {'action': 'decrement'}, name='decrement_cart_json'),
+    path('api/remove/<int:product_id>/<int:cart_item_id>/', views.change_cart_json, {'action': 'remove'}, name='remove_cart_json'),
 ]
@@ -1,209 +1,141 @@
 from django.shortcuts import render, redirect
-from store.models import Product, Variation
-from .models import Cart, CartItem
-from django.core.exceptions import ObjectDoesNotExist
+from store.models import Product, variation_signature
+from store.variations import resolve_variations, InvalidVariation
+from .models import CartItem
+from .mutations import get_cart, add_item, increment_item, decrement_item, remove_item
+from .summary import CartSummary, cart_items_for
+from .guest import SessionCart, session_storage
 from django.shortcuts import get_object_or_404
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+from django.db.models import Sum
+
+# Session key holding the navbar badge count
+CART_COUNT_SESSION_KEY = 'cart_count'
 
 # Create your views here.
 def _cart_id(request):
     cart = request.session.session_key
     if not cart:
-        cart = request.session.create()
+        request.session.create()
+        cart = request.session.session_key
     return cart
-    
-def add_cart(request, product_id):
-    current_user = request.user
-    product = Product.objects.get(id=product_id)
-    # If the user is authenticated
-    if current_user.is_authenticated:
-        product_variation = [] 
-        if request.method == "POST":
-            for item in request.POST:
-                key = item
-                value = request.POST[key]
-                
-                try:
-                    variation = Variation.objects.get(product=product, variation_category__iexact=key, variation_value__iexact=value)
-                    product_variation.append(variation)
-                except:
-                    pass
-        
- 
-
-        # Check if cart item already exists
-        cart_item_exists = CartItem.objects.filter(product=product, user=current_user).exists()
-
-        if cart_item_exists:
-            cart_item = CartItem.objects.filter(product=product, user=current_user)
-            ex_var_list = []
-            id = []
-            for item in cart_item:
-                existing_variation = item.variations.all()
-                ex_var_list.append(list(existing_variation))
-                id.append(item.id)
-
-            if product_variation in ex_var_list:
-                # include the cart item quantity
-                index = ex_var_list.index(product_variation)
-                item_id = id[index]
-                item = CartItem.objects.get(product=product, id=item_id)
-                item.quantity += 1
-                item.save()
-
-            else:
-                item = CartItem.objects.create(product=product, quantity=1, user=current_user)
-                if len(product_variation) > 0:
-                    item.variations.add(*product_variation)
-                item.save()
+
+def _cart_count(request):
+    # Total quantity in the cart, cached in the session until the cart changes
+    if session_storage(request):
+        # Already in the session, nothing to cache
+        return SessionCart(request.session).quantity()
+    if request.session.session_key is None:
+        # A visitor without a session has no cart, and caching 0 would create a session row
+        return 0
+    count = request.session.get(CART_COUNT_SESSION_KEY)
+    if count is None:
+        summary = getattr(request, '_cart_summary', None)
+        if summary is not None:
+            # The page already loaded the whole cart
+            count = summary.quantity
         else:
-            item = CartItem.objects.create(product=product, quantity=1, user=current_user)
-            if len(product_variation) > 0:
-                item.variations.add(*product_variation)
-            item.save()
+            count = cart_items_for(request).aggregate(count=Sum('quantity'))['count'] or 0
+        request.session[CART_COUNT_SESSION_KEY] = count
+    return count
 
-        return redirect('cart')
+def _clear_cart_count(request):
+    request.session.pop(CART_COUNT_SESSION_KEY, None)
     
-    # If the user is not authenticated
+def _add(request, product, variation_ids):
+    if request.user.is_authenticated:
+        add_item(product, variation_ids, user=request.user)
+    elif session_storage(request):
+        SessionCart(request.session).add(product.id, variation_ids)
     else:
-        product_variation = [] 
-        if request.method == "POST":
-            for item in request.POST:
-                key = item
-                value = request.POST[key]
-                
-                try:
-                    variation = Variation.objects.get(product=product, variation_category__iexact=key, variation_value__iexact=value)
-                    product_variation.append(variation)
-                except:
-                    pass
-        
-        # Cart logic
-        try:
-            cart_obj = Cart.objects.get(cart_id=_cart_id(request)) 
-        except Cart.DoesNotExist:
-            cart_obj = Cart.objects.create(
-                cart_id = _cart_id(request)
-            )
-        cart_obj.save()  
-
-        # Check if cart item already exists
-        cart_item_exists = CartItem.objects.filter(product=product, cart=cart_obj).exists()
-
-        if cart_item_exists:
-            cart_item = CartItem.objects.filter(product=product, cart=cart_obj)
-            
-            # Existing variations -> Database 
-            # Current variation -> product_variation 
-            # Item ID -> Database 
-            
-            ex_var_list = []
-            id = []
-            for item in cart_item:
-                existing_variation = item.variations.all()
-                ex_var_list.append(list(existing_variation))
-                id.append(item.id)
-
-            if product_variation in ex_var_list:
-                index = ex_var_list.index(product_variation)
-                item_id = id[index]
-                item = CartItem.objects.get(product=product, id=item_id)
-                item.quantity += 1
-                item.save()
-            else:
-                item = CartItem.objects.create(product=product, quantity=1, cart=cart_obj)
-                if len(product_variation) > 0:
-                    item.variations.add(*product_variation)
-                item.save()
-        else:
-            item = CartItem.objects.create(product=product, quantity=1, cart=cart_obj)
-            if len(product_variation) > 0:
-                item.variations.add(*product_variation)
-            item.save()
+        add_item(product, variation_ids, cart=get_cart(_cart_id(request)))
+    _clear_cart_count(request)
+
+def _cart_line(request, product, cart_item_id):
+    # The line only if it belongs to this user or guest session
+    if request.user.is_authenticated:
+        return CartItem.objects.filter(product=product, user=request.user, id=cart_item_id)
+    return CartItem.objects.filter(product=product, cart__cart_id=_cart_id(request), user=None, id=cart_item_id)
+
+def _change_line(request, product, cart_item_id, action):
+    # action is 'increment', 'decrement' or 'remove'
+    if session_storage(request):
+        getattr(SessionCart(request.session), action)(product.id, cart_item_id)
+    else:
+        mutation = {'increment': increment_item, 'decrement': decrement_item, 'remove': remove_item}[action]
+        mutation(_cart_line(request, product, cart_item_id))
+    _clear_cart_count(request)
+
+def add_cart(request, product_id):
+    product = Product.objects.get(id=product_id)
 
-        return redirect('cart')
+    # Every submitted (category, value) pair, resolved from the cached variation map
+    product_variation = []
+    if request.method == "POST":
+        try:
+            product_variation = resolve_variations(product.id, request.POST)
+        except InvalidVariation as e:
+            messages.error(request, f'Please choose a valid option ({e}).')
+            return redirect(request.META.get('HTTP_REFERER') or product.get_url())
 
+    _add(request, product, product_variation)
+    return redirect('cart')
 
 def remove_cart(request, product_id, cart_item_id):
     product = get_object_or_404(Product, id=product_id)
-    try:
-        if request.user.is_authenticated:
-            cart_item = CartItem.objects.get(product=product, user=request.user, id=cart_item_id)
-        else:
-            cart = Cart.objects.get(cart_id=_cart_id(request))
-            cart_item = CartItem.objects.get(product=product, user=request.user, id=cart_item_id)
-        if cart_item.quantity > 1:
-            cart_item.quantity -= 1
-            cart_item.save()
-        else:
-            cart_item.delete()
-    except:
-        pass
+    _change_line(request, product, cart_item_id, 'decrement')
     return redirect('cart')
 
 def remove_cart_item(request, product_id, cart_item_id):
     product = get_object_or_404(Product, id=product_id)
-    if request.user.is_authenticated:
-        cart_item = CartItem.objects.get(product=product, user=request.user, id=cart_item_id)
-    else:
-        cart = Cart.objects.get(cart_id=_cart_id(request))
-        cart_item = CartItem.objects.get(product=product, cart=cart, id=cart_item_id)
-    cart_item.delete()
+    _change_line(request, product, cart_item_id, 'remove')
     return redirect('cart')
 
-def cart(request, total=0, quantity=0, cart_items=None):
+def _cart_json(request, match, status=200, **extra):
+    # The changed line (None once it is gone) and the new totals, for in-place updates
+    summary = CartSummary.for_request(request)
+    line = next((item for item in summary.cart_items if match(item)), None)
+    return JsonResponse({
+        'line': line and {
+            'id': line.id,
+            'product_id': line.product.id,
+            'quantity': line.quantity,
+            'sub_total': line.sub_total(),
+        },
+        'cart': {
+            'count': _cart_count(request),
+            'total': summary.total,
+            'tax': summary.tax,
+            'grand_total': summary.grand_total,
+        },
+        **extra,
+    }, status=status)
+
+@require_POST
+def add_cart_json(request, product_id):
+    product = get_object_or_404(Product, id=product_id)
     try:
-        tax = 0
-        grand_total = 0
-        if request.user.is_authenticated:
-            cart_items = CartItem.objects.filter(user=request.user)
-        else:
-            cart = Cart.objects.get(cart_id=_cart_id(request))
-            cart_items = CartItem.objects.filter(cart=cart)
-
-        for cart_item in cart_items:
-            total += (cart_item.product.price * cart_item.quantity)
-            quantity += cart_item.quantity
-            
-        tax = (2 * total)/100
-        grand_total = total + tax
-
-    except ObjectDoesNotExist:
-        pass #just ignore
-
-    context = {
-        'total': total,
-        'quantity': quantity,
-        'cart_items': cart_items,
-        'tax': tax,
-        'grand_total' : grand_total,
-    }
-    return render(request, 'store/cart.html', context)
+        variation_ids = resolve_variations(product.id, request.POST)
+    except InvalidVariation as e:
+        return _cart_json(request, lambda item: False, status=400, error=f'Please choose a valid option ({e}).')
+    _add(request, product, variation_ids)
+    signature = variation_signature(variation_ids)
+    return _cart_json(request, lambda item: item.product.id == product.id and item.variation_signature == signature)
+
+@require_POST
+def change_cart_json(request, action, product_id, cart_item_id):
+    product = get_object_or_404(Product, id=product_id)
+    _change_line(request, product, cart_item_id, action)
+    return _cart_json(request, lambda item: item.id == cart_item_id)
+
+def cart(request):
+    summary = CartSummary.for_request(request)
+    return render(request, 'store/cart.html', summary.context())
 
 @login_required(login_url='login')
-def checkout(request, total=0, quantity=0, cart_items=None):
-    try:
-        tax = 0
-        grand_total = 0
-        if request.user.is_authenticated:
-            cart_items = CartItem.objects.filter(user=request.user)
-        else:
-            cart = Cart.objects.get(cart_id=_cart_id(request))
-            cart_items = CartItem.objects.filter(cart=cart)
-
-        for cart_item in cart_items:
-            total += (cart_item.product.price * cart_item.quantity)
-            quantity += cart_item.quantity
-        tax = (2 * total)/100
-        grand_total = total + tax
-    except ObjectDoesNotExist:
-        pass #just ignore
-
-    context = {
-        'total': total,
-        'quantity': quantity,
-        'cart_items': cart_items,
-        'tax': tax,
-        'grand_total' : grand_total,
-    }
-    return render(request,'store/checkout.html',context)
\ No newline at end of file
+def checkout(request):
+    summary = CartSummary.for_request(request)
+    return render(request,'store/checkout.html',summary.context())
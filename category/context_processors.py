@@ -1,5 +1,5 @@
-from .models import Category
+from .menu import get_menu
 
 def menu_links(request):
-    links = Category.objects.all()
-    return dict(links=links)
\ No newline at end of file
+    links = get_menu()
+    return dict(links=links)
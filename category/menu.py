@@ -0,0 +1,46 @@
+from collections import namedtuple
+from uuid import uuid4
+from django.core.cache import cache
+from .models import Category
+
+MENU_VERSION_KEY = 'category:menu:version'
+
+MenuLink = namedtuple('MenuLink', ['category_name', 'slug', 'url'])
+
+# (version, links) last seen by this process
+_local_menu = (None, None)
+
+def menu_version():
+    # A random token rather than a counter: if the key is evicted, the new version
+    # can never match a menu cached under an older one
+    version = cache.get(MENU_VERSION_KEY)
+    if version is None:
+        cache.add(MENU_VERSION_KEY, uuid4().hex, None)
+        version = cache.get(MENU_VERSION_KEY)
+    return version
+
+def bump_menu_version():
+    # Seen by every process through the shared cache, see CACHES in settings
+    cache.set(MENU_VERSION_KEY, uuid4().hex, None)
+
+def build_menu():
+    return [
+        MenuLink(category.category_name, category.slug, category.get_url())
+        for category in Category.objects.order_by('id').only('category_name', 'slug')
+    ]
+
+def get_menu():
+    # Process copy first, then the shared cache, then the database
+    global _local_menu
+    version = menu_version()
+    local_version, links = _local_menu
+    if local_version == version:
+        return links
+
+    key = f'category:menu:{version}'
+    links = cache.get(key)
+    if links is None:
+        links = build_menu()
+        cache.set(key, links, None)
+    _local_menu = (version, links)
+    return links
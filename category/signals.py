@@ -0,0 +1,11 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Category
+from .menu import bump_menu_version
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_menu(sender, **kwargs):
+    # After commit, so no process rebuilds the menu from the old rows under the new version
+    transaction.on_commit(bump_menu_version)
@@ -1,3 +1,34 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory
+from .context_processors import menu_links
+from .menu import MENU_VERSION_KEY
+from .models import Category
 
 # Create your tests here.
+class MenuLinksTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.request = RequestFactory().get('/')
+        Category.objects.create(category_name='Shirts', slug='shirts')
+
+    def test_steady_state_costs_no_queries(self):
+        menu_links(self.request)
+        with self.assertNumQueries(0):
+            links = menu_links(self.request)['links']
+        self.assertEqual([(link.category_name, link.url) for link in links], [('Shirts', '/store/category/shirts/')])
+
+    def test_save_and_delete_invalidate_menu(self):
+        menu_links(self.request)
+        with self.captureOnCommitCallbacks(execute=True):
+            jeans = Category.objects.create(category_name='Jeans', slug='jeans')
+        self.assertEqual([link.slug for link in menu_links(self.request)['links']], ['shirts', 'jeans'])
+        with self.captureOnCommitCallbacks(execute=True):
+            jeans.delete()
+        self.assertEqual([link.slug for link in menu_links(self.request)['links']], ['shirts'])
+
+    def test_evicted_version_does_not_reuse_an_old_menu(self):
+        menu_links(self.request)
+        cache.delete(MENU_VERSION_KEY)
+        Category.objects.create(category_name='Jeans', slug='jeans')
+        cache.delete(MENU_VERSION_KEY)
+        self.assertEqual([link.slug for link in menu_links(self.request)['links']], ['shirts', 'jeans'])
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
     'store',
     'carts',
     'orders',
+    'jobs',
     'admin_honeypot',
 ]
 
@@ -96,10 +97,40 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock up front so concurrent cart writes queue instead of failing
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        'TEST': {
+            # A file, not shared memory, so live server threads get their own connections
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
 
+# Cache shared by every worker process: the category menu version, the variation
+# maps and the product card fragments are invalidated through it, so it must not be
+# the per-process default. The file cache is shared by the processes of one host and
+# holds about three entries per product (two cards, one variation map); every set
+# lists the cache directory and culls a third of it once MAX_ENTRIES is reached, so
+# size CACHE_MAX_ENTRIES to the catalogue. For large catalogues or several hosts point
+# CACHE_BACKEND/CACHE_LOCATION at Redis or Memcached. Tests use their own in-memory
+# cache, see greatkart.test_runner.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('CACHE_LOCATION', default=str(BASE_DIR / 'cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=10000, cast=int),
+        },
+    }
+}
+
+TEST_RUNNER = 'greatkart.test_runner.TestRunner'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -159,4 +190,20 @@ EMAIL_USE_TLS = config('EMAIL_USE_TLS', cast=bool) # true
 # Session timeout
 SESSION_EXPIRE_SECONDS = 3600
 SESSION_EXPIRE_AFTER_LAST_ACTIVITY = True
-SESSION_TIMEOUT_REDIRECT = 'login/'
\ No newline at end of file
+SESSION_TIMEOUT_REDIRECT = 'login/'
+# Where anonymous carts live: 'db' (Cart/CartItem rows) or 'session'. With 'session'
+# the rows are only written at login; pair it with
+# SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies' to keep guests
+# off the database entirely.
+CART_STORAGE = config('CART_STORAGE', default='db')
+
+# Rendered invoice PDFs, see orders.invoices. Not under MEDIA_ROOT so they are never public.
+INVOICE_ROOT = BASE_DIR / 'invoices'
+
+# WeasyPrint process pool, see orders.pdf
+PDF_WORKERS = config('PDF_WORKERS', default=2, cast=int)
+PDF_TIMEOUT = config('PDF_TIMEOUT', default=60, cast=int)
+PDF_MAX_TASKS_PER_WORKER = 100
+
+# How long placed, unpaid orders hold their stock; release_reservations gives it back
+STOCK_RESERVATION_MINUTES = 15
@@ -46,6 +46,62 @@ $(document).ready(function() {
 
 
 
+	//////////////////////// Cart changes without reloading the page
+    // Links and forms with data-cart-api post to the JSON endpoints in carts/urls.py,
+    // the plain href/action stays as the fallback
+    function cartRequest(url, data, done) {
+        data = data || {};
+        data.csrfmiddlewaretoken = $('[name=csrfmiddlewaretoken]').first().val();
+        $.post(url, data).done(done).fail(function (xhr) {
+            if (xhr.status == 400) {
+                alert($.parseJSON(xhr.responseText).error);
+            }
+        });
+    }
+
+    function updateCart(response) {
+        var cart = response.cart;
+        $('.js-cart-count').text(cart.count);
+        $('.js-cart-total').text('$' + cart.total);
+        $('.js-cart-tax').text('$' + cart.tax);
+        $('.js-cart-grand-total').text('$' + cart.grand_total);
+        if (!response.line) {
+            return;
+        }
+        var row = $('[data-cart-line=' + response.line.id + ']');
+        row.find('.js-line-quantity').val(response.line.quantity);
+        row.find('.js-line-total').text('$ ' + response.line.sub_total);
+    }
+
+    $(document).on('click', 'a[data-cart-api]', function (e) {
+        if (e.isDefaultPrevented()) {
+            // Cancelled in the confirm dialog
+            return;
+        }
+        e.preventDefault();
+        var row = $(this).closest('[data-cart-line]');
+        cartRequest($(this).data('cart-api'), null, function (response) {
+            updateCart(response);
+            if (!response.line) {
+                row.remove();
+            }
+            if (response.cart.count == 0) {
+                // Show the empty cart message
+                window.location.reload();
+            }
+        });
+    });
+
+    $(document).on('submit', 'form[data-cart-api]', function (e) {
+        e.preventDefault();
+        var data = {};
+        $.each($(this).serializeArray(), function (i, field) {
+            data[field.name] = field.value;
+        });
+        cartRequest($(this).data('cart-api'), data, updateCart);
+    });
+
+
 	//////////////////////// Bootstrap tooltip
 	if($('[data-toggle="tooltip"]').length>0) {  // check if element exists
 		$('[data-toggle="tooltip"]').tooltip()
@@ -0,0 +1,16 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+class TestRunner(DiscoverRunner):
+    # Tests get a private in-memory cache, so cache.clear() in a test never touches
+    # the shared cache a running dev server uses
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._test_cache = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        })
+        self._test_cache.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_cache.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,27 @@
+import shutil
+import tempfile
+from django.test.utils import override_settings
+from accounts.models import Account
+
+# Helpers shared by the apps' tests
+
+def create_customer(username='john', first_name='John', last_name='Doe'):
+    # An activated account, as if the email link had been followed
+    user = Account.objects.create_user(first_name, last_name, username, f'{username}@example.com', 'secret')
+    user.is_active = True
+    user.save()
+    return user
+
+# The session timeout middleware rewrites the session on a timer, query counts
+# measured through the client must not include that
+without_session_timeout = override_settings(SESSION_EXPIRE_AFTER_LAST_ACTIVITY=False)
+
+class TemporaryInvoiceRootMixin:
+    # Rendered invoices go to a directory of their own, removed after each test
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        override = override_settings(INVOICE_ROOT=root)
+        override.enable()
+        self.addCleanup(override.disable)
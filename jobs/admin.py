@@ -0,0 +1,10 @@
+from django.contrib import admin
+from .models import Job
+
+# Register your models here.
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('task', 'status', 'attempts', 'max_attempts', 'run_at', 'created_at')
+    list_filter = ('status', 'task')
+    readonly_fields = ('last_error', 'created_at', 'updated_at')
+
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from jobs.queue import run_pending, work
+from orders.pdf import warm_pool
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs, retrying failures with exponential backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due now and exit')
+        parser.add_argument('--sleep', type=float, default=5, help='Seconds between polls when idle (default 5)')
+        parser.add_argument('--max-jobs', type=int, help='Exit after running this many jobs')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            succeeded, failed = run_pending(options['max_jobs'])
+            self.stdout.write(self.style.SUCCESS(f'Ran {succeeded} job(s), {failed} failed.'))
+            return
+        # Confirmation jobs render invoices, have the PDF workers ready for the first one
+        warm_pool()
+        for succeeded, failed in work(options['sleep'], options['max_jobs']):
+            if succeeded or failed:
+                self.stdout.write(f'Ran {succeeded} job(s), {failed} failed.')
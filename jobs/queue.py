@@ -0,0 +1,97 @@
+import time
+import traceback
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Job
+
+# Retry delays double from BACKOFF_BASE seconds up to BACKOFF_MAX
+BACKOFF_BASE = 30
+BACKOFF_MAX = 60 * 60
+# A running job whose worker died is picked up again after this long
+LOCK_TIMEOUT = timedelta(minutes=10)
+
+def task_path(task):
+    return task if isinstance(task, str) else f'{task.__module__}.{task.__qualname__}'
+
+def enqueue(task, max_attempts=5, run_at=None, **payload):
+    # Queue task(**payload); payload must be JSON serializable. Inside a transaction
+    # the job only becomes visible to workers once it commits.
+    return Job.objects.create(
+        task=task_path(task), payload=payload, max_attempts=max_attempts,
+        run_at=run_at or timezone.now(),
+    )
+
+def backoff(attempts):
+    return timedelta(seconds=min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX))
+
+def claim_job():
+    # Mark the next due job running, one short transaction so two workers never share it
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            job = (
+                Job.objects.select_for_update(skip_locked=True)
+                .filter(
+                    Q(status=Job.QUEUED, run_at__lte=now)
+                    | Q(status=Job.RUNNING, locked_at__lt=now - LOCK_TIMEOUT)
+                )
+                .order_by('run_at', 'id')
+                .first()
+            )
+            if job is None:
+                return None
+            if job.status == Job.RUNNING and job.attempts >= job.max_attempts:
+                # The last attempt crashed its worker or outran LOCK_TIMEOUT, don't retry it forever
+                job.status = Job.FAILED
+                job.last_error = f'No result {LOCK_TIMEOUT} after attempt {job.attempts}, worker lost or timed out.'
+                job.save(update_fields=['status', 'last_error', 'updated_at'])
+                continue
+            job.status = Job.RUNNING
+            job.locked_at = now
+            job.attempts += 1
+            job.save(update_fields=['status', 'locked_at', 'attempts', 'updated_at'])
+        return job
+
+def run_job(job):
+    # Returns True when the task succeeded, otherwise the job is rescheduled or failed
+    try:
+        import_string(job.task)(**job.payload)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+        else:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + backoff(job.attempts)
+        job.save(update_fields=['status', 'run_at', 'last_error', 'updated_at'])
+        return False
+    job.status = Job.DONE
+    job.save(update_fields=['status', 'updated_at'])
+    return True
+
+def run_pending(limit=None):
+    # Run due jobs until none are left (or limit reached), returns (succeeded, failed)
+    succeeded = failed = 0
+    while limit is None or succeeded + failed < limit:
+        job = claim_job()
+        if job is None:
+            break
+        if run_job(job):
+            succeeded += 1
+        else:
+            failed += 1
+    return succeeded, failed
+
+def work(poll_interval=5, limit=None):
+    # Worker loop for run_worker
+    while True:
+        succeeded, failed = run_pending(limit)
+        yield succeeded, failed
+        if limit is not None:
+            limit -= succeeded + failed
+            if limit <= 0:
+                return
+        time.sleep(poll_interval)
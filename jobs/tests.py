@@ -0,0 +1,63 @@
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from .models import Job
+from .queue import enqueue, run_pending
+
+calls = []
+
+def record(value):
+    calls.append(value)
+
+def explode():
+    raise RuntimeError('mail server down')
+
+# Create your tests here.
+class JobQueueTest(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_and_run(self):
+        job = enqueue(record, value=42)
+        self.assertEqual(job.task, 'jobs.tests.record')
+        out = StringIO()
+        call_command('run_worker', '--once', stdout=out)
+        self.assertIn('Ran 1 job(s), 0 failed.', out.getvalue())
+        self.assertEqual(calls, [42])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 1))
+
+    def test_failures_back_off_then_fail(self):
+        job = enqueue(explode, max_attempts=2)
+        self.assertEqual(run_pending(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('mail server down', job.last_error)
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=20))
+        # Not due yet
+        self.assertEqual(run_pending(), (0, 0))
+
+        Job.objects.update(run_at=timezone.now())
+        self.assertEqual(run_pending(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_jobs_of_a_dead_worker_are_picked_up_again(self):
+        enqueue(record, value=1)
+        Job.objects.update(status=Job.RUNNING, locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(calls, [1])
+
+    def test_stale_job_on_its_last_attempt_fails(self):
+        job = enqueue(record, value=1, max_attempts=2)
+        enqueue(record, value=2)
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.RUNNING, attempts=2, locked_at=timezone.now() - timedelta(hours=1),
+        )
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(calls, [2])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIn('worker lost or timed out', job.last_error)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Order, OrderProduct, Payment
+from .models import Order, OrderProduct, Payment, StockReservation
 
 # Register your models here.
 class OrderProductInline(admin.TabularInline):
@@ -13,6 +13,11 @@ class OrderAdmin(admin.ModelAdmin):
     search_fields = ['order_number','first_name','last_name','phone','email']
     list_per_page = 20
 
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['order','product','quantity','status','expires_at']
+    list_filter = ['status']
+
 admin.site.register(Order, OrderAdmin)
 admin.site.register(Payment)
-admin.site.register(OrderProduct)
\ No newline at end of file
+admin.site.register(OrderProduct)
+admin.site.register(StockReservation, StockReservationAdmin)
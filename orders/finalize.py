@@ -0,0 +1,38 @@
+from django.db import transaction
+from carts.models import CartItem
+from carts.summary import load_cart_items
+from .inventory import commit_order, sold_quantities
+from .models import OrderProduct
+
+# The same handful of statements whatever the size of the cart:
+# bulk insert of the order lines and their variations, the stock reservation
+# commit and one DELETE of the cart, in a single transaction.
+
+def finalize_order(order, payment, user):
+    # Mark the order paid and move the user's cart into it, returns the new OrderProducts
+    with transaction.atomic():
+        order.payment = payment
+        order.is_ordered = True
+        order.save()
+
+        cart_items = load_cart_items(CartItem.objects.filter(user=user))
+        order_products = OrderProduct.objects.bulk_create([
+            OrderProduct(
+                order=order, payment=payment, user=user, product=item.product,
+                variation_signature=item.variation_signature, quantity=item.quantity,
+                product_price=item.product.price, ordered=True,
+            )
+            for item in cart_items
+        ])
+
+        Through = OrderProduct.variations.through
+        Through.objects.bulk_create([
+            Through(orderproduct_id=order_product.pk, variation_id=variation.pk)
+            for order_product, item in zip(order_products, cart_items)
+            for variation in item.variations.all()
+        ])
+
+        # Stock held since place_order becomes sold, raises OutOfStock if it lapsed and is gone
+        commit_order(order, sold_quantities(cart_items))
+        CartItem.objects.filter(pk__in=[item.pk for item in cart_items]).delete()
+    return order_products
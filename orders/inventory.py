@@ -0,0 +1,101 @@
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from store.models import Product
+from .models import Order, StockReservation
+
+# Stock is taken when the order is placed and held until it is paid or the
+# reservation expires. Every change to Product.stock is a single conditional
+# UPDATE, so two checkouts can never both take the last units.
+
+class OutOfStock(Exception):
+    def __init__(self, products):
+        self.products = products
+        super().__init__('Not enough stock for ' + ', '.join(p.product_name for p in products))
+
+def sold_quantities(cart_items):
+    # {product id: units} for a list of cart lines
+    quantities = Counter()
+    for item in cart_items:
+        quantities[item.product_id] += item.quantity
+    return quantities
+
+def _per_product(quantities):
+    return Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+def take_stock(quantities):
+    # All or nothing: raises OutOfStock (and the caller's transaction rolls back)
+    # unless every product has enough left
+    if not quantities:
+        return
+    per_product = _per_product(quantities)
+    taken = Product.objects.filter(pk__in=quantities, stock__gte=per_product).update(
+        stock=F('stock') - per_product, modified_date=timezone.now(),
+    )
+    if taken != len(quantities):
+        short = Product.objects.filter(pk__in=quantities).exclude(stock__gte=per_product)
+        raise OutOfStock(list(short))
+
+def return_stock(quantities):
+    if quantities:
+        Product.objects.filter(pk__in=quantities).update(
+            stock=F('stock') + _per_product(quantities), modified_date=timezone.now(),
+        )
+
+def release(reservations):
+    # Give back the stock of held reservations, a queryset; returns how many were released
+    with transaction.atomic():
+        held = list(reservations.select_for_update().filter(status=StockReservation.HELD))
+        returned = Counter()
+        for reservation in held:
+            returned[reservation.product_id] += reservation.quantity
+        StockReservation.objects.filter(pk__in=[r.pk for r in held]).update(status=StockReservation.RELEASED)
+        return_stock(returned)
+    return len(held)
+
+def reserve_order(order, quantities):
+    # Hold stock for a newly placed order, raises OutOfStock
+    expires_at = timezone.now() + timedelta(minutes=settings.STOCK_RESERVATION_MINUTES)
+    with transaction.atomic():
+        # Only the latest unpaid order of the customer keeps its stock
+        release(StockReservation.objects.filter(
+            order__in=Order.objects.filter(user=order.user_id, is_ordered=False).exclude(pk=order.pk),
+        ))
+        take_stock(quantities)
+        StockReservation.objects.bulk_create([
+            StockReservation(order=order, product_id=pk, quantity=quantity, expires_at=expires_at)
+            for pk, quantity in quantities.items()
+        ])
+
+def commit_order(order, quantities):
+    # Turn the order's held stock into sold stock at payment. Whatever the reservation
+    # no longer covers (expired, or the cart changed since) is taken now or given back.
+    with transaction.atomic():
+        held = list(
+            StockReservation.objects.select_for_update().filter(order=order, status=StockReservation.HELD)
+        )
+        reserved = Counter()
+        for reservation in held:
+            reserved[reservation.product_id] += reservation.quantity
+        StockReservation.objects.filter(pk__in=[r.pk for r in held]).update(status=StockReservation.COMMITTED)
+
+        missing = Counter(quantities)
+        missing.subtract(reserved)
+        take_stock({pk: n for pk, n in missing.items() if n > 0})
+        return_stock({pk: -n for pk, n in missing.items() if n < 0})
+
+def release_expired(batch_size=500):
+    # Sweeper: give back the stock of expired reservations, one short transaction per batch
+    released = 0
+    expired = StockReservation.objects.filter(status=StockReservation.HELD, expires_at__lte=timezone.now())
+    while True:
+        ids = list(expired.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return released
+        released += release(StockReservation.objects.filter(pk__in=ids))
@@ -0,0 +1,112 @@
+import hashlib
+import re
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from .models import OrderProduct
+from .pdf import render_pdf
+
+# Invoices are rendered once per order and content, then served from INVOICE_ROOT.
+# That is outside MEDIA_ROOT on purpose, they must not be publicly reachable.
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def invoice_storage():
+    return FileSystemStorage(location=settings.INVOICE_ROOT)
+
+def invoice_context(order):
+    order_details = list(
+        OrderProduct.objects.filter(order_id=order.id).select_related('product').prefetch_related('variations')
+    )
+    return {
+        'user': order.user,
+        'order': order,
+        'order_details': order_details,
+        'subtotal': sum(item.product_price * item.quantity for item in order_details),
+    }
+
+def invoice_digest(context):
+    # Exactly what accounts/invoice_pdf.html prints, so it changes when the invoice does
+    order = context['order']
+    parts = [
+        order.order_number, order.created_at.date(), order.payment and order.payment.payment_method,
+        order.full_name(), order.full_address(), order.city, order.state, order.country, order.phone,
+        order.tax, order.order_total, context['subtotal'],
+    ]
+    for item in context['order_details']:
+        parts += [
+            item.product.product_name, [v.variation_value for v in item.variations.all()],
+            item.product_price, item.quantity, item.subtotal(),
+        ]
+    return hashlib.sha1('\x1f'.join(map(str, parts)).encode()).hexdigest()
+
+def invoice_name(order_number, digest):
+    return f'{order_number}/Invoice_{order_number}_{digest[:16]}.pdf'
+
+def get_invoice(order, base_url):
+    # (storage name, digest) of the order's current invoice, rendered only if it isn't stored yet
+    context = invoice_context(order)
+    digest = invoice_digest(context)
+    name = invoice_name(order.order_number, digest)
+    storage = invoice_storage()
+    if not storage.exists(name):
+        html_string = render_to_string('accounts/invoice_pdf.html', context)
+        pdf = render_pdf(html_string, base_url)
+        if not storage.exists(name):
+            storage.save(name, ContentFile(pdf))
+        # Earlier versions of the invoice are never served again
+        _, stored = storage.listdir(order.order_number)
+        for old_name in stored:
+            if f'{order.order_number}/{old_name}' != name:
+                storage.delete(f'{order.order_number}/{old_name}')
+    return name, digest
+
+def read_invoice(name):
+    with invoice_storage().open(name, 'rb') as invoice:
+        return invoice.read()
+
+def invoice_response(request, order, name, digest):
+    # The stored PDF with an ETag, answering If-None-Match and single byte ranges
+    etag = f'"{digest}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return response
+
+    storage = invoice_storage()
+    size = storage.size(name)
+    filename = f'Invoice_{order.order_number}.pdf'
+    byte_range = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if byte_range and if_range not in (None, etag):
+        # The client's partial copy is of an older invoice, send all of it
+        byte_range = None
+
+    match = RANGE_RE.match(byte_range or '')
+    if match and any(match.groups()):
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            # bytes=-500 is the last 500 bytes
+            start, end = max(size - int(last), 0), size - 1
+        if start > end or start >= size:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        with storage.open(name, 'rb') as invoice:
+            invoice.seek(start)
+            response = HttpResponse(invoice.read(end - start + 1), status=206, content_type='application/pdf')
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    else:
+        response = FileResponse(storage.open(name, 'rb'), as_attachment=True, filename=filename, content_type='application/pdf')
+        response['Content-Length'] = size
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    # Private: the invoice carries the customer's address
+    response['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    return response
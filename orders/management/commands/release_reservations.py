@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from orders.inventory import release_expired
+
+class Command(BaseCommand):
+    help = 'Give back the stock held by expired reservations of unpaid orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Reservations released per transaction (default 500)')
+
+    def handle(self, *args, **options):
+        released = release_expired(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired reservation(s).'))
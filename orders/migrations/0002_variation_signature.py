@@ -0,0 +1,46 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:26
+
+import hashlib
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_signatures(apps, schema_editor):
+    # Sign existing lines and fold duplicates into the first one before the constraint lands
+    OrderProduct = apps.get_model('orders', 'OrderProduct')
+    seen = {}
+    for item in OrderProduct.objects.prefetch_related('variations').order_by('id'):
+        ids = sorted({v.pk for v in item.variations.all()})
+        item.variation_signature = hashlib.sha1(','.join(map(str, ids)).encode()).hexdigest() if ids else ''
+        key = (item.order_id, item.product_id, item.variation_signature)
+        if key in seen:
+            first = seen[key]
+            first.quantity += item.quantity
+            first.save(update_fields=['quantity'])
+            item.delete()
+        else:
+            item.save(update_fields=['variation_signature'])
+            seen[key] = item
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0001_initial'),
+        ('store', '0008_product_url_path'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderproduct',
+            name='variation_signature',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.RunPython(fill_signatures, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='orderproduct',
+            constraint=models.UniqueConstraint(fields=('order', 'product', 'variation_signature'), name='unique_order_line'),
+        ),
+    ]
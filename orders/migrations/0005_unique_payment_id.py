@@ -0,0 +1,53 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:47
+
+from django.db import migrations, models
+
+
+def merge_duplicate_payments(apps, schema_editor):
+    # Keep the oldest Payment of each transaction id and point its orders and lines at it
+    Payment = apps.get_model('orders', 'Payment')
+    Order = apps.get_model('orders', 'Order')
+    OrderProduct = apps.get_model('orders', 'OrderProduct')
+    keep = {}
+    for payment in Payment.objects.order_by('id'):
+        if payment.payment_id not in keep:
+            keep[payment.payment_id] = payment
+            continue
+        target = keep[payment.payment_id]
+        Order.objects.filter(payment=payment).update(payment=target)
+        OrderProduct.objects.filter(payment=payment).update(payment=target)
+        payment.delete()
+
+
+def snapshot_responses(apps, schema_editor):
+    # What payments answered for existing captures, so their retries replay too
+    Order = apps.get_model('orders', 'Order')
+    for order in Order.objects.filter(payment__isnull=False).select_related('payment'):
+        order.payment.response = {'order_number': order.order_number, 'transID': order.payment.payment_id}
+        order.payment.save(update_fields=['response'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_payments, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='payment',
+            name='payment_id_idx',
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='response',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='payment_id',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.RunPython(snapshot_responses, migrations.RunPython.noop),
+    ]
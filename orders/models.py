@@ -5,10 +5,13 @@ from store.models import Product, Variation
 # Create your models here.
 class Payment(models.Model):
     user = models.ForeignKey(Account, on_delete=models.CASCADE)
-    payment_id = models.CharField(max_length=100)
+    # PayPal's transaction id, one Payment per transaction however often the callback retries
+    payment_id = models.CharField(max_length=100, unique=True)
     payment_method = models.CharField(max_length=100)
     amount_paid = models.CharField(max_length=100)
     status = models.CharField(max_length=100)
+    # JSON answer of the first capture, replayed to retries
+    response = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -20,6 +23,8 @@ class Order(models.Model):
         ('Accepted','Accepted'),
         ('Completed','Completed'),
         ('Cancelled','Cancelled'),
+        # Paid, but the stock was gone at payment: the charge has to be refunded
+        ('Oversold','Oversold'),
     )
 
     user = models.ForeignKey(Account, on_delete=models.SET_NULL, null=True)
@@ -40,9 +45,21 @@ class Order(models.Model):
     status = models.CharField(max_length=10, choices=STATUS, default='New')
     ip = models.CharField(blank=True, max_length=20)
     is_ordered = models.BooleanField(default=False)
+    # Confirmation email, see orders.tasks.send_order_confirmation: a run holds a lease
+    # on it while sending, and sent_at is only set once the email went out
+    confirmation_claimed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    confirmation_sent_at = models.DateTimeField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # The customer's pending order at checkout and their order history
+            models.Index(fields=['user', 'is_ordered', 'order_number'], name='order_user_idx'),
+            # Order pages and invoices looked up by number
+            models.Index(fields=['order_number', 'is_ordered'], name='order_number_idx'),
+        ]
+
     def full_name(self):
         return f'{self.first_name} {self.last_name}'
 
@@ -58,14 +75,51 @@ class OrderProduct(models.Model):
     user = models.ForeignKey(Account, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     variations = models.ManyToManyField(Variation, blank=True)
+    # store.models.variation_signature() of the variations
+    variation_signature = models.CharField(max_length=40, blank=True, default='')
     quantity = models.IntegerField()
     product_price = models.FloatField()
     ordered = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['order', 'product', 'variation_signature'],
+                name='unique_order_line',
+            ),
+        ]
+
     def __str__(self):
         return self.product.product_name
 
     def subtotal(self):
-        return self.product_price * self.quantity
\ No newline at end of file
+        return self.product_price * self.quantity
+
+class StockReservation(models.Model):
+    # Units taken off Product.stock for an unpaid order, see orders.inventory
+    HELD = 'held'
+    COMMITTED = 'committed'
+    RELEASED = 'released'
+    STATUS = (
+        (HELD, 'Held'),
+        (COMMITTED, 'Committed'),
+        (RELEASED, 'Released'),
+    )
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS, default=HELD)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # The sweeper's "held and expired" lookup
+            models.Index(fields=['status', 'expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} x {self.product} for {self.order.order_number}'
@@ -0,0 +1,75 @@
+import atexit
+import logging
+import multiprocessing
+import threading
+from django.conf import settings
+
+# WeasyPrint only ever runs in these worker processes: web processes that never
+# render a PDF don't pay for importing it, and at most PDF_WORKERS layouts run at
+# once, the rest wait their turn. PDF_WORKERS = 0 renders in the calling process.
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+class PDFRenderTimeout(Exception):
+    pass
+
+def _warm_up():
+    # A failing import must not kill the worker: Pool would respawn it forever and
+    # every render would wait out PDF_TIMEOUT. _render raises the real error instead.
+    try:
+        import weasyprint  # noqa: F401
+    except Exception:
+        logger.exception('Could not import WeasyPrint in the PDF worker')
+
+def _render(html_string, base_url):
+    from weasyprint import HTML
+
+    return HTML(string=html_string, base_url=base_url).write_pdf()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the children need nothing from a threaded web process
+            _pool = multiprocessing.get_context('spawn').Pool(
+                processes=settings.PDF_WORKERS,
+                initializer=_warm_up,
+                # Recycle workers now and then, layout memory is not always given back
+                maxtasksperchild=settings.PDF_MAX_TASKS_PER_WORKER,
+            )
+        return _pool
+
+def warm_pool():
+    # Start the workers ahead of the first render, for processes that render anyway
+    # (run_worker); web processes start them on their first invoice
+    if settings.PDF_WORKERS:
+        _get_pool()
+
+def close_pool(pool=None):
+    # Terminate the current pool, or only `pool` if it still is the current one: a
+    # render that timed out on a pool already replaced must not kill the new one
+    global _pool
+    with _pool_lock:
+        if _pool is None or (pool is not None and pool is not _pool):
+            return
+        pool, _pool = _pool, None
+    pool.terminate()
+    pool.join()
+
+atexit.register(close_pool)
+
+def render_pdf(html_string, base_url=None):
+    # PDF bytes for html_string, raises PDFRenderTimeout after PDF_TIMEOUT seconds
+    if not settings.PDF_WORKERS:
+        return _render(html_string, base_url)
+    pool = _get_pool()
+    result = pool.apply_async(_render, (html_string, base_url))
+    try:
+        return result.get(timeout=settings.PDF_TIMEOUT)
+    except multiprocessing.TimeoutError:
+        # The stuck layout can't be cancelled, replace the pool it runs in
+        close_pool(pool)
+        raise PDFRenderTimeout(f'PDF rendering took longer than {settings.PDF_TIMEOUT}s')
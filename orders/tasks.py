@@ -0,0 +1,58 @@
+from django.core.mail import EmailMessage
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+from accounts.models import Account
+from jobs.queue import LOCK_TIMEOUT
+from .invoices import get_invoice, invoice_context, read_invoice
+from .models import Order
+
+# Background jobs, queued with jobs.queue.enqueue and run by the run_worker command
+
+class ConfirmationInProgress(Exception):
+    pass
+
+def send_order_confirmation(order_id, base_url):
+    # Confirmation email with the invoice PDF attached; failures raise so the job is retried
+    order = Order.objects.select_related('user').get(id=order_id)
+    if order.confirmation_sent_at:
+        return
+
+    # Lease the email: a second run (a job re-claimed after outrunning its lock, or a
+    # duplicate job) leaves it alone while the lease is fresh. A lease left behind by a
+    # worker that died mid-send expires after the queue's LOCK_TIMEOUT.
+    now = timezone.now()
+    claimable = Order.objects.filter(id=order_id, confirmation_sent_at=None).filter(
+        Q(confirmation_claimed_at=None) | Q(confirmation_claimed_at__lt=now - LOCK_TIMEOUT)
+    )
+    if not claimable.update(confirmation_claimed_at=now):
+        if Order.objects.filter(id=order_id, confirmation_sent_at__isnull=False).exists():
+            return
+        raise ConfirmationInProgress(f'Order {order.order_number} is being confirmed by another run')
+    try:
+        context = invoice_context(order)
+        message = render_to_string('orders/order_recieved_email.html', context)
+        send_email = EmailMessage('Thank you for your order!', message, to=[order.user.email])
+
+        # The same stored file the order page's download link serves
+        name, _ = get_invoice(order, base_url)
+        send_email.attach(f'Invoice_{order.order_number}.pdf', read_invoice(name), 'application/pdf')
+        send_email.send()
+    except Exception:
+        # Not sent, let the retry claim it again
+        Order.objects.filter(id=order_id).update(confirmation_claimed_at=None)
+        raise
+    Order.objects.filter(id=order_id).update(confirmation_sent_at=timezone.now())
+
+def notify_oversold_order(order_id):
+    # Tell the staff that a captured payment could not be filled and has to be refunded
+    order = Order.objects.select_related('payment').get(id=order_id)
+    staff = list(Account.objects.filter(is_staff=True, is_active=True).values_list('email', flat=True))
+    if not staff:
+        return
+    message = (
+        f'Order {order.order_number} was paid with PayPal transaction {order.payment.payment_id} '
+        f'({order.payment.amount_paid}) after its stock ran out. Please refund the customer '
+        f'({order.full_name()}, {order.email}).'
+    )
+    EmailMessage(f'Refund needed for order {order.order_number}', message, to=staff).send()
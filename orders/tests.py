@@ -1,3 +1,434 @@
-from django.test import TestCase
+import json
+import re
+import sys
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import skipUnless
+from unittest.mock import patch
+from django.conf import settings
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from accounts.models import Account
+from greatkart.testing import TemporaryInvoiceRootMixin, create_customer, without_session_timeout
+from carts.models import Cart, CartItem
+from category.models import Category
+from jobs.models import Job
+from jobs.queue import LOCK_TIMEOUT, run_pending
+from carts.mutations import add_item
+from store.models import Product, ReviewRating, Variation
+from . import invoices, pdf
+from .inventory import OutOfStock, reserve_order
+from .models import Order, OrderProduct, Payment, StockReservation
+from .pdf import PDFRenderTimeout, close_pool, render_pdf
+from .tasks import ConfirmationInProgress, send_order_confirmation
 
 # Create your tests here.
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite syntax')
+class QueryPlanTest(TestCase):
+    # Hot lookups must be answered from an index, never a full table scan
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_customer()
+        cls.category = Category.objects.create(category_name='Shirts', slug='shirts')
+        cls.product = Product.objects.create(
+            product_name='Blue Shirt', slug='blue-shirt', price=10,
+            images='photos/products/test.jpg', stock=5, category=cls.category,
+        )
+        cls.cart = Cart.objects.create(cart_id='session')
+
+    def assertNoFullScan(self, queryset):
+        plan = queryset.explain()
+        scans = [line for line in plan.splitlines() if re.search(r'\bSCAN \w+$', line.strip())]
+        self.assertFalse(scans, f'{queryset.query}\n{plan}')
+
+    def test_cart_lookups(self):
+        self.assertNoFullScan(Cart.objects.filter(cart_id='session'))
+        self.assertNoFullScan(CartItem.objects.filter(user=self.user, product=self.product))
+        self.assertNoFullScan(CartItem.objects.filter(user=self.user))
+        self.assertNoFullScan(CartItem.objects.filter(cart=self.cart, product=self.product, user=None))
+        self.assertNoFullScan(CartItem.objects.filter(cart__cart_id='session', user=None))
+
+    def test_order_lookups(self):
+        self.assertNoFullScan(Order.objects.filter(user=self.user, is_ordered=False, order_number='2026101801'))
+        self.assertNoFullScan(Order.objects.filter(user=self.user, is_ordered=True).order_by('-created_at'))
+        self.assertNoFullScan(Order.objects.filter(order_number='2026101801', is_ordered=True))
+        self.assertNoFullScan(Payment.objects.filter(payment_id='PAY-1'))
+
+    def test_store_lookups(self):
+        self.assertNoFullScan(ReviewRating.objects.filter(product=self.product, status=True))
+        self.assertNoFullScan(Product.objects.filter(is_available=True).order_by('id'))
+        self.assertNoFullScan(Product.objects.filter(category=self.category, is_available=True).order_by('id'))
+
+class PaymentJobTest(TemporaryInvoiceRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_customer()
+        self.client.force_login(self.user)
+        self.category = Category.objects.create(category_name='Shirts', slug='shirts')
+        self.product = Product.objects.create(
+            product_name='Blue Shirt', slug='blue-shirt', price=10,
+            images='photos/products/test.jpg', stock=5, category=self.category,
+        )
+        CartItem.objects.create(user=self.user, product=self.product, quantity=2)
+        self.order = Order.objects.create(
+            user=self.user, order_number='2026101801', first_name='John', last_name='Doe',
+            phone='123', email='john@example.com', address_line_1='Street', country='X',
+            state='Y', city='Z', order_total=20.4, tax=0.4,
+        )
+
+    def pay(self, trans_id='PAY-1'):
+        return self.client.post(reverse('payments'), json.dumps({
+            'orderID': self.order.order_number, 'transID': trans_id,
+            'payment_method': 'PayPal', 'status': 'COMPLETED',
+        }), content_type='application/json')
+
+    def test_confirmation_is_sent_by_the_worker(self):
+        response = self.pay()
+        self.assertEqual(response.json(), {'order_number': '2026101801', 'transID': 'PAY-1'})
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(Job.objects.get().task, 'orders.tasks.send_order_confirmation')
+
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(mail.outbox[0].to, ['john@example.com'])
+        self.assertEqual(mail.outbox[0].attachments[0][0], 'Invoice_2026101801.pdf')
+
+    @patch('orders.tasks.read_invoice', return_value=b'%PDF')
+    @patch('orders.tasks.get_invoice', return_value=('invoice.pdf', 'etag'))
+    def test_confirmation_is_sent_once(self, get_invoice, read_invoice):
+        send_order_confirmation(self.order.id, 'http://testserver/')
+        # Run again, e.g. by a job re-claimed after outrunning its lock
+        send_order_confirmation(self.order.id, 'http://testserver/')
+        self.assertEqual(len(mail.outbox), 1)
+        self.order.refresh_from_db()
+        self.assertIsNotNone(self.order.confirmation_sent_at)
+
+    @patch('orders.tasks.get_invoice', side_effect=PDFRenderTimeout)
+    def test_failed_confirmation_is_retried(self, get_invoice):
+        with self.assertRaises(PDFRenderTimeout):
+            send_order_confirmation(self.order.id, 'http://testserver/')
+        self.order.refresh_from_db()
+        self.assertIsNone(self.order.confirmation_claimed_at)
+        self.assertIsNone(self.order.confirmation_sent_at)
+
+    @patch('orders.tasks.read_invoice', return_value=b'%PDF')
+    @patch('orders.tasks.get_invoice', return_value=('invoice.pdf', 'etag'))
+    def test_lease_of_a_dead_worker_expires(self, get_invoice, read_invoice):
+        # Claimed by a run that is still sending: leave it alone and retry later
+        Order.objects.filter(pk=self.order.pk).update(confirmation_claimed_at=timezone.now())
+        with self.assertRaises(ConfirmationInProgress):
+            send_order_confirmation(self.order.id, 'http://testserver/')
+        self.assertEqual(len(mail.outbox), 0)
+
+        # The worker was killed mid-send and never cleared its claim
+        Order.objects.filter(pk=self.order.pk).update(confirmation_claimed_at=timezone.now() - LOCK_TIMEOUT * 2)
+        send_order_confirmation(self.order.id, 'http://testserver/')
+        self.assertEqual(len(mail.outbox), 1)
+        self.order.refresh_from_db()
+        self.assertIsNotNone(self.order.confirmation_sent_at)
+
+    def test_cart_moves_into_the_order(self):
+        blue = Variation.objects.create(product=self.product, variation_category='color', variation_value='Blue')
+        add_item(self.product, [blue.id], user=self.user, quantity=1)
+        self.pay()
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.is_ordered)
+        lines = OrderProduct.objects.filter(order=self.order).order_by('id')
+        self.assertEqual([(line.quantity, line.product_price) for line in lines], [(2, 10), (1, 10)])
+        self.assertEqual(list(lines[1].variations.all()), [blue])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 2)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_retried_callback_replays_the_first_response(self):
+        first = self.pay().json()
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.pay()
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json(), first)
+        # Answered from the stored snapshot alone
+        self.assertEqual([q['sql'] for q in queries if 'orders_' in q['sql']], [queries[-1]['sql']])
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(Job.objects.count(), 1)
+        self.assertEqual(OrderProduct.objects.count(), 1)
+
+    def test_transaction_id_of_another_customer(self):
+        other = create_customer('jane', 'Jane')
+        Payment.objects.create(user=other, payment_id='PAY-1', payment_method='PayPal', amount_paid='1', status='COMPLETED')
+        response = self.pay()
+        self.assertEqual(response.status_code, 409)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.is_ordered)
+
+    def payment_queries(self, size):
+        for i in range(size):
+            product = Product.objects.create(
+                product_name=f'Shirt {size}-{i}', slug=f'shirt-{size}-{i}', price=10,
+                images='photos/products/test.jpg', stock=5, category=self.category,
+            )
+            color = Variation.objects.create(product=product, variation_category='color', variation_value='Blue')
+            add_item(product, [color.id], user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.pay(f'PAY-{size}')
+        return len(queries)
+
+    @without_session_timeout
+    def test_query_count_does_not_grow_with_cart_size(self):
+        # The first request also stamps the session for the timeout middleware, measure after it
+        self.pay('PAY-0')
+        Order.objects.filter(pk=self.order.pk).update(is_ordered=False)
+        small = self.payment_queries(1)
+        Order.objects.filter(pk=self.order.pk).update(is_ordered=False)
+        self.assertEqual(self.payment_queries(6), small)
+
+class InvoiceTest(TemporaryInvoiceRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_customer()
+        self.client.force_login(self.user)
+        category = Category.objects.create(category_name='Shirts', slug='shirts')
+        self.product = Product.objects.create(
+            product_name='Blue Shirt', slug='blue-shirt', price=10,
+            images='photos/products/test.jpg', stock=5, category=category,
+        )
+        self.order = Order.objects.create(
+            user=self.user, order_number='2026101801', first_name='John', last_name='Doe',
+            phone='123', email='john@example.com', address_line_1='Street', country='X',
+            state='Y', city='Z', order_total=20.4, tax=0.4, is_ordered=True,
+        )
+        self.line = OrderProduct.objects.create(
+            order=self.order, user=self.user, product=self.product, quantity=2, product_price=10, ordered=True,
+        )
+        self.url = reverse('generate_pdf_invoice', args=[self.order.order_number])
+
+    def stored_invoices(self):
+        return sorted(path.name for path in Path(settings.INVOICE_ROOT).rglob('*.pdf'))
+
+    def test_rendered_once_and_served_with_etag(self):
+        with patch('orders.invoices.render_pdf', wraps=invoices.render_pdf) as render:
+            first = self.client.get(self.url)
+            body = b''.join(first.streaming_content)
+            self.assertEqual(first['Content-Length'], str(len(body)))
+            self.assertTrue(body.startswith(b'%PDF'))
+
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+            send_order_confirmation(self.order.id, 'http://testserver/')
+            self.assertEqual(mail.outbox[0].attachments[0][1], body)
+            self.assertEqual(render.call_count, 1)
+
+    def test_range_requests(self):
+        body = b''.join(self.client.get(self.url).streaming_content)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, body[:4])
+        self.assertEqual(response['Content-Range'], f'bytes 0-3/{len(body)}')
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=-2').content, body[-2:])
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE=f'bytes={len(body)}-').status_code, 416)
+        # A range of an older version gets the whole current file
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE='"old"').status_code, 200)
+
+    def test_changed_order_renders_a_new_invoice(self):
+        etag = self.client.get(self.url)['ETag']
+        self.line.quantity = 3
+        self.line.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        # The superseded version is removed
+        self.assertEqual(len(self.stored_invoices()), 1)
+        self.assertIn(response['ETag'].strip('"')[:16], self.stored_invoices()[0])
+
+    def test_digest_covers_only_printed_fields(self):
+        with patch('orders.invoices.render_pdf', return_value=b'%PDF'):
+            name, digest = invoices.get_invoice(self.order, 'http://testserver/')
+            self.order.status = 'Completed'
+            self.order.email = 'other@example.com'
+            self.order.save()
+            self.assertEqual(invoices.get_invoice(self.order, 'http://testserver/'), (name, digest))
+
+            self.order.payment = Payment.objects.create(
+                user=self.user, payment_id='PAY-1', payment_method='PayPal', amount_paid='20.40', status='COMPLETED',
+            )
+            self.order.save()
+            new_name, new_digest = invoices.get_invoice(self.order, 'http://testserver/')
+        self.assertNotEqual(new_digest, digest)
+        self.assertEqual(self.stored_invoices(), [Path(new_name).name])
+
+    def test_only_the_owner_can_download(self):
+        other = create_customer('jane', 'Jane')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+class PdfPoolTest(TestCase):
+    def setUp(self):
+        self.addCleanup(close_pool)
+
+    @override_settings(PDF_WORKERS=1)
+    def test_renders_in_a_worker_process(self):
+        self.assertTrue(render_pdf('<p>Invoice</p>').startswith(b'%PDF'))
+        self.assertNotIn('weasyprint', sys.modules)
+
+    @override_settings(PDF_WORKERS=1, PDF_TIMEOUT=0)
+    def test_timeout_replaces_the_pool(self):
+        with self.assertRaises(PDFRenderTimeout):
+            render_pdf('<p>Invoice</p>')
+        with self.settings(PDF_TIMEOUT=60):
+            self.assertTrue(render_pdf('<p>Invoice</p>').startswith(b'%PDF'))
+
+    @override_settings(PDF_WORKERS=1, PDF_TIMEOUT=30)
+    def test_render_errors_are_raised_right_away(self):
+        # No source for WeasyPrint (or no WeasyPrint at all): the worker's own error comes
+        # back instead of workers crashing until the timeout
+        started = time.monotonic()
+        with self.assertRaises(Exception) as raised:
+            render_pdf(None)
+        self.assertNotIsInstance(raised.exception, PDFRenderTimeout)
+        self.assertLess(time.monotonic() - started, 20)
+
+    @override_settings(PDF_WORKERS=1)
+    def test_late_timeout_keeps_the_replacement_pool(self):
+        stale = pdf._get_pool()
+        close_pool(stale)
+        current = pdf._get_pool()
+        # Another render timing out on the pool that was already replaced
+        close_pool(stale)
+        self.assertIs(pdf._get_pool(), current)
+
+class StockReservationTest(TestCase):
+    def setUp(self):
+        self.user = create_customer()
+        self.client.force_login(self.user)
+        category = Category.objects.create(category_name='Shirts', slug='shirts')
+        self.product = Product.objects.create(
+            product_name='Blue Shirt', slug='blue-shirt', price=10,
+            images='photos/products/test.jpg', stock=5, category=category,
+        )
+        add_item(self.product, user=self.user, quantity=2)
+
+    def place_order(self):
+        return self.client.post(reverse('place_order'), {
+            'first_name': 'John', 'last_name': 'Doe', 'phone': '123', 'email': 'john@example.com',
+            'address_line_1': 'Street', 'country': 'X', 'state': 'Y', 'city': 'Z',
+        })
+
+    def pay(self, order):
+        return self.client.post(reverse('payments'), json.dumps({
+            'orderID': order.order_number, 'transID': f'PAY-{order.pk}',
+            'payment_method': 'PayPal', 'status': 'COMPLETED',
+        }), content_type='application/json')
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.stock
+
+    def test_place_order_holds_and_payment_commits(self):
+        self.assertEqual(self.place_order().status_code, 200)
+        order = Order.objects.get()
+        self.assertEqual(self.stock(), 3)
+        self.assertEqual(self.pay(order).status_code, 200)
+        self.assertEqual(self.stock(), 3)
+        self.assertEqual(StockReservation.objects.get().status, StockReservation.COMMITTED)
+
+    def test_placing_again_releases_the_previous_order(self):
+        self.place_order()
+        self.place_order()
+        self.assertEqual(self.stock(), 3)
+        self.assertEqual(StockReservation.objects.filter(status=StockReservation.HELD).count(), 1)
+
+    def test_not_enough_stock(self):
+        Product.objects.update(stock=1)
+        response = self.place_order()
+        self.assertRedirects(response, reverse('cart'), fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.stock(), 1)
+
+    def test_sweeper_releases_expired_reservations(self):
+        self.place_order()
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        out = StringIO()
+        call_command('release_reservations', stdout=out)
+        self.assertIn('Released 1 expired reservation(s).', out.getvalue())
+        self.assertEqual(self.stock(), 5)
+
+        # Paying late takes the stock again while it is there
+        self.assertEqual(self.pay(Order.objects.get()).status_code, 200)
+        self.assertEqual(self.stock(), 3)
+
+    def test_late_payment_when_stock_is_gone(self):
+        self.place_order()
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        call_command('release_reservations', stdout=StringIO())
+        Product.objects.update(stock=1)
+        order = Order.objects.get()
+        staff = create_customer('ann', 'Ann', 'Admin')
+        Account.objects.filter(pk=staff.pk).update(is_staff=True)
+        response = self.pay(order)
+        self.assertEqual(response.status_code, 409)
+        order.refresh_from_db()
+        self.assertFalse(order.is_ordered)
+        self.assertEqual(self.stock(), 1)
+
+        # The money was captured: the payment is kept and the order flagged for a refund
+        payment = Payment.objects.get(payment_id=f'PAY-{order.pk}')
+        self.assertEqual(order.payment, payment)
+        self.assertEqual(order.status, 'Oversold')
+        self.assertFalse(OrderProduct.objects.exists())
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(mail.outbox[0].to, ['ann@example.com'])
+        self.assertIn(payment.payment_id, mail.outbox[0].body)
+
+        # A retried callback gets the same answer and records nothing new
+        retry = self.pay(order)
+        self.assertEqual((retry.status_code, retry.json()), (409, response.json()))
+        self.assertEqual(Payment.objects.count(), 1)
+
+class ConcurrentReservationTest(TransactionTestCase):
+    # Parallel checkouts of the last units: exactly as many succeed as there are units
+    buyers = 10
+
+    def test_no_oversell(self):
+        category = Category.objects.create(category_name='Shirts', slug='shirts')
+        product = Product.objects.create(
+            product_name='Blue Shirt', slug='blue-shirt', price=10,
+            images='photos/products/test.jpg', stock=3, category=category,
+        )
+        orders = []
+        for i in range(self.buyers):
+            user = create_customer(f'john{i}')
+            orders.append(Order.objects.create(
+                user=user, order_number=f'O{i}', first_name='John', last_name='Doe', phone='1',
+                email=user.email, address_line_1='Street', country='X', state='Y', city='Z',
+                order_total=10.2, tax=0.2,
+            ))
+
+        barrier = threading.Barrier(self.buyers)
+        outcomes = []
+
+        def buy(order):
+            barrier.wait()
+            try:
+                reserve_order(order, {product.pk: 1})
+                outcomes.append('reserved')
+            except OutOfStock:
+                outcomes.append('sold out')
+            except Exception as e:
+                outcomes.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=[order]) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(outcomes), ['reserved'] * 3 + ['sold out'] * 7)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(StockReservation.objects.count(), 3)
@@ -1,36 +1,37 @@
 import json
 import datetime
 from django.shortcuts import render, redirect
-from carts.models import CartItem
+from django.contrib import messages
+from carts.views import _clear_cart_count
+from carts.summary import CartSummary
 from .forms import OrderForm, Order
-from weasyprint import HTML
+from jobs.queue import enqueue
+from .finalize import finalize_order
+from .inventory import OutOfStock, reserve_order, sold_quantities
+from .tasks import notify_oversold_order, send_order_confirmation
 
+from django.db import IntegrityError, transaction
 from django.http import JsonResponse
+from django.utils import timezone
 from .models import Payment, OrderProduct
-from store.models import Product
-from django.core.mail import EmailMessage
-from django.template.loader import render_to_string
 
 # Create your views here.
 from django.contrib.auth.decorators import login_required
 
 @login_required(login_url='login')
-def place_order(request, total=0, quantity=0):
+def place_order(request):
     current_user = request.user
 
+    summary = CartSummary.for_request(request)
+
     #If the cart count is less than or equal to 0, then redirect back to shop
-    cart_items = CartItem.objects.filter(user=current_user)
-    cart_count = cart_items.count()
-    if cart_count <= 0:
+    if len(summary) <= 0:
         return redirect('store')
-    
-    grand_total = 0
-    tax = 0
-    for cart_item in cart_items:
-        total += (cart_item.product.price * cart_item.quantity)
-        quantity += cart_item.quantity
-    tax = (2 * total)/100
-    grand_total = total + tax 
+
+    cart_items = summary.cart_items
+    total = summary.total
+    tax = summary.tax
+    grand_total = summary.grand_total
     
     if request.method == "POST":
         form = OrderForm(request.POST)
@@ -52,17 +53,25 @@ def place_order(request, total=0, quantity=0):
             data.order_total = grand_total
             data.tax = tax
             data.ip = request.META.get('REMOTE_ADDR')
-            data.save()
-
-            # Generate order number 
-            yr = int(datetime.date.today().strftime('%Y'))
-            dt = int(datetime.date.today().strftime('%d'))
-            mt = int(datetime.date.today().strftime('%m'))
-            d = datetime.date(yr, mt, dt)
-            current_date = d.strftime("%Y%m%d") 
-            order_number = current_date + str(data.id)
-            data.order_number = order_number
-            data.save()
+            try:
+                with transaction.atomic():
+                    data.save()
+
+                    # Generate order number 
+                    yr = int(datetime.date.today().strftime('%Y'))
+                    dt = int(datetime.date.today().strftime('%d'))
+                    mt = int(datetime.date.today().strftime('%m'))
+                    d = datetime.date(yr, mt, dt)
+                    current_date = d.strftime("%Y%m%d") 
+                    order_number = current_date + str(data.id)
+                    data.order_number = order_number
+                    data.save()
+
+                    # Hold the stock while the customer pays
+                    reserve_order(data, sold_quantities(cart_items))
+            except OutOfStock as e:
+                messages.error(request, f'Sorry, {e}. Please update your cart.')
+                return redirect('cart')
 
             order = Order.objects.get(user=current_user, is_ordered=False, order_number=order_number)
             context = {
@@ -79,91 +88,90 @@ def place_order(request, total=0, quantity=0):
     else:
         return redirect('checkout')
 
+def _captured_response(user, trans_id):
+    # The stored answer of an already captured transaction, a single indexed read
+    return Payment.objects.filter(payment_id=trans_id, user=user).values_list('response', flat=True).first()
+
+def _replay(captured):
+    # A payment recorded for an oversold order keeps answering with its error
+    return JsonResponse(captured, status=409 if 'error' in captured else 200)
+
+def _record_oversold_payment(request, order, body, error):
+    # PayPal has already taken the money but the stock is gone: the order is not
+    # filled, yet the Payment is kept so the staff can refund it
+    data = {
+        'error': f'Sorry, {error}. Your payment was recorded and will be refunded.',
+        'order_number': order.order_number,
+    }
+    try:
+        with transaction.atomic():
+            payment = Payment.objects.create(
+                user = request.user,
+                payment_id = body['transID'],
+                payment_method = body['payment_method'],
+                amount_paid = order.order_total,
+                status = body['status'],
+                response = data,
+            )
+            Order.objects.filter(pk=order.pk).update(payment=payment, status='Oversold', updated_at=timezone.now())
+            enqueue(notify_oversold_order, order_id=order.id)
+    except IntegrityError:
+        captured = _captured_response(request.user, body['transID'])
+        if captured:
+            return _replay(captured)
+        return JsonResponse({'error': 'This payment was already used.'}, status=409)
+    return JsonResponse(data, status=409)
+
 def payments(request):
     body = json.loads(request.body)
-    order = Order.objects.get(user=request.user, is_ordered=False, order_number=body['orderID'])
-
-    # 1. Payment store in the table
-    payment = Payment(
-        user = request.user,
-        payment_id = body['transID'],
-        payment_method = body['payment_method'],
-        amount_paid = order.order_total,
-        status = body['status'],
-    )
-    payment.save()
-
-    # 2. Update the Order table
-    order.payment = payment
-    order.is_ordered = True
-    order.save()
-
-    # 3. Move the Cart Items to OrderProduct table 
-    cart_items = CartItem.objects.filter(user=request.user)
-
-    for item in cart_items:
-        orderproduct = OrderProduct()
-        orderproduct.order_id = order.id
-        orderproduct.payment = payment
-        orderproduct.user_id = request.user.id
-        orderproduct.product_id = item.product_id
-        orderproduct.quantity = item.quantity
-        orderproduct.product_price = item.product.price
-        orderproduct.ordered = True
-        orderproduct.save()
-
-        # save the product variation
-        product_variation = item.variations.all()
-        orderproduct.variations.set(product_variation)
-        orderproduct.save()
-
-        # 4. Reduce Stock
-        product = Product.objects.get(id=item.product_id)
-        product.stock -= item.quantity
-        product.save()
-
-    # 5. After the payment delete the cartitem
-    CartItem.objects.filter(user=request.user).delete()
-
-    # --- 📄 PDF and Email Logic  ---
-    
-    order_details = OrderProduct.objects.filter(order_id=order.id)
-    subtotal = sum(item.product_price * item.quantity for item in order_details)
-    
-    mail_subject = 'Thank you for your order!'
-    
-    # Data for Email Body
-    context = {
-        'user': request.user,
-        'order': order,
-        'order_details': order_details,
-        'subtotal': subtotal,
-    }
-    
-    message = render_to_string('orders/order_recieved_email.html', context)
-    to_email = request.user.email
-    
-    # create EmailMessage object
-    send_email = EmailMessage(mail_subject, message, to=[to_email])
-    
-    # WeasyPrint through PDF Generate
-    html_string = render_to_string('accounts/invoice_pdf.html', context)
-    pdf = HTML(string=html_string, base_url=request.build_absolute_uri()).write_pdf()
-    
-    # Atteched the PDF 
-    send_email.attach(f'Invoice_{order.order_number}.pdf', pdf, 'application/pdf')
-    
-    # Sent Email
+
+    # PayPal's callback may retry: answer it exactly like the first time
+    captured = _captured_response(request.user, body['transID'])
+    if captured:
+        return _replay(captured)
+
     try:
-        send_email.send()
-    except Exception as e:
-        print(f"Email error: {e}")
+        order = Order.objects.get(user=request.user, is_ordered=False, order_number=body['orderID'])
+    except Order.DoesNotExist:
+        # Paid by a parallel retry since the lookup above
+        captured = _captured_response(request.user, body['transID'])
+        if captured:
+            return _replay(captured)
+        return JsonResponse({'error': 'Order not found.'}, status=404)
 
-    # 6. Success response
     data = {
         'order_number': order.order_number,
-        'transID': payment.payment_id,
+        'transID': body['transID'],
     }
+    try:
+        with transaction.atomic():
+            # 1. Payment store in the table, with the response for retries
+            payment = Payment.objects.create(
+                user = request.user,
+                payment_id = body['transID'],
+                payment_method = body['payment_method'],
+                amount_paid = order.order_total,
+                status = body['status'],
+                response = data,
+            )
+
+            # 2. Mark the order paid, move the cart into it and commit the held stock
+            finalize_order(order, payment, request.user)
+
+            # 3. Invoice PDF and confirmation email, sent by the run_worker command once this commits
+            enqueue(send_order_confirmation, order_id=order.id, base_url=request.build_absolute_uri())
+    except IntegrityError:
+        # The transaction id is already captured, by a parallel retry or for another order
+        captured = _captured_response(request.user, body['transID'])
+        if captured:
+            return _replay(captured)
+        return JsonResponse({'error': 'This payment was already used.'}, status=409)
+    except OutOfStock as e:
+        # The reservation expired and someone else bought the units, everything above rolled back
+        return _record_oversold_payment(request, order, body, e)
+    _clear_cart_count(request)
+
+    # 4. Success response
     return JsonResponse(data)
 
 def payment_complete(request):
@@ -9,7 +9,7 @@ class ProductGalleryInline(admin.TabularInline):
     extra = 1
 
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('product_name','price','stock','modified_date','is_available')
+    list_display = ('product_name','price','stock','rating_average','rating_count','modified_date','is_available')
     prepopulated_fields = {'slug':('product_name',)}
     inlines = [ProductGalleryInline]
 
@@ -18,7 +18,12 @@ class VariationAdmin(admin.ModelAdmin):
     list_editable = ('is_active',)
     list_filter = ('product','variation_category','variation_value')
 
+class ReviewRatingAdmin(admin.ModelAdmin):
+    list_display = ('product','user','subject','rating','status','updated_date')
+    list_editable = ('status',)
+    list_filter = ('status',)
+
 admin.site.register(Product,ProductAdmin)
 admin.site.register(Variation,VariationAdmin)
-admin.site.register(ReviewRating)
+admin.site.register(ReviewRating,ReviewRatingAdmin)
 admin.site.register(ProductGallery)
\ No newline at end of file
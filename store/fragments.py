@@ -0,0 +1,62 @@
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from category.menu import menu_version
+
+# Keys change whenever their inputs do, so entries only need to age out
+CARD_TIMEOUT = 60 * 60 * 24
+
+# Hit and miss counters in the shared cache, added to by every worker; read them
+# with the card_cache_stats command. Approximate: on backends without an atomic
+# incr (the default file cache) concurrent pages can overwrite each other's counts.
+STATS_KEYS = {'hits': 'store:card:stats:hits', 'misses': 'store:card:stats:misses'}
+
+def card_cache_key(product, variant, version):
+    # modified_date covers product edits, the rating columns cover reviews and
+    # the category menu version covers slug changes that move get_url()
+    return 'store:card:{}:{}:{}:{}:{}:{}:{}'.format(
+        variant,
+        product.pk,
+        product.modified_date.timestamp(),
+        product.thumbnails_ready(),
+        product.rating_count,
+        product.rating_sum,
+        version,
+    )
+
+def render_product_cards(products, variant):
+    # HTML of every product's card, one cache read for the whole page
+    products = list(products)
+    version = menu_version()
+    keys = [card_cache_key(product, variant, version) for product in products]
+    cached = cache.get_many(keys)
+    missed = {}
+    cards = []
+    for product, key in zip(products, keys):
+        html = cached.get(key)
+        if html is None:
+            html = missed[key] = render_to_string(f'includes/product_card_{variant}.html', {'product': product})
+        cards.append(html)
+    if missed:
+        cache.set_many(missed, CARD_TIMEOUT)
+    _count('hits', len(cards) - len(missed))
+    _count('misses', len(missed))
+    return cards
+
+def _count(name, delta):
+    if not delta:
+        return
+    try:
+        cache.incr(STATS_KEYS[name], delta)
+    except ValueError:
+        # First count, or the key was evicted
+        if not cache.add(STATS_KEYS[name], delta, None):
+            cache.incr(STATS_KEYS[name], delta)
+
+def card_cache_stats():
+    values = cache.get_many(STATS_KEYS.values())
+    stats = {name: values.get(key, 0) for name, key in STATS_KEYS.items()}
+    total = stats['hits'] + stats['misses']
+    return dict(stats, ratio=stats['hits'] / total if total else 0)
+
+def reset_card_cache_stats():
+    cache.delete_many(STATS_KEYS.values())
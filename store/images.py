@@ -0,0 +1,65 @@
+from io import BytesIO
+from django.core.files.base import ContentFile
+from PIL import Image, UnidentifiedImageError
+
+# Widths generated for every product and gallery image, each as JPEG and WebP
+THUMBNAIL_WIDTHS = (300, 600)
+FORMATS = (('jpg', 'JPEG'), ('webp', 'WEBP'))
+
+def derivative_name(name, width, ext):
+    # photos/products/shirt.png -> photos/products/shirt.png_300w.webp, the source
+    # extension kept so shirt.png and shirt.jpg don't share derivatives
+    return f'{name}_{width}w.{ext}'
+
+def derivative_url(fieldfile, width, ext):
+    return fieldfile.storage.url(derivative_name(fieldfile.name, width, ext))
+
+def srcset(fieldfile, widths, ext):
+    # widths as recorded by refresh_derivatives, the real width of each file
+    return ', '.join(f'{derivative_url(fieldfile, width, ext)} {width}w' for width in widths)
+
+def generate_derivatives(fieldfile):
+    # Write the resized copies next to the original, returns their widths, or None if
+    # it can't be read. Small originals are never upscaled, so they get fewer, narrower files.
+    storage = fieldfile.storage
+    try:
+        with storage.open(fieldfile.name, 'rb') as source:
+            original = Image.open(source)
+            original.load()
+    except (OSError, UnidentifiedImageError):
+        return None
+
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+
+    widths = []
+    for width in THUMBNAIL_WIDTHS:
+        image = original.copy()
+        image.thumbnail((width, width * 4))
+        if image.width in widths:
+            continue
+        widths.append(image.width)
+        for ext, image_format in FORMATS:
+            output = BytesIO()
+            if image_format == 'JPEG':
+                image.convert('RGB').save(output, image_format, quality=85, optimize=True, progressive=True)
+            else:
+                image.save(output, image_format, quality=80, method=4)
+            name = derivative_name(fieldfile.name, image.width, ext)
+            if storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(output.getvalue()))
+    return widths
+
+def refresh_derivatives(instance, field_name, force=False):
+    # Regenerate when the image changed since the last run, record which file they came from
+    fieldfile = getattr(instance, field_name)
+    if not fieldfile or (instance.derivatives_of == fieldfile.name and not force):
+        return False
+    widths = generate_derivatives(fieldfile)
+    if not widths:
+        return False
+    instance.derivatives_of = fieldfile.name
+    instance.derivative_widths = widths
+    type(instance).objects.filter(pk=instance.pk).update(derivatives_of=fieldfile.name, derivative_widths=widths)
+    return True
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from store.fragments import card_cache_stats, reset_card_cache_stats
+
+class Command(BaseCommand):
+    help = 'Show the product card cache hit ratio of every worker since the last reset'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Start counting again after printing')
+
+    def handle(self, *args, **options):
+        stats = card_cache_stats()
+        self.stdout.write(
+            f"{stats['hits']} hit(s), {stats['misses']} miss(es), hit ratio {stats['ratio']:.1%}"
+        )
+        if options['reset']:
+            reset_card_cache_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset.'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from store.images import refresh_derivatives
+from store.models import Product, ProductGallery
+
+class Command(BaseCommand):
+    help = 'Generate thumbnail and WebP derivatives for product and gallery images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate even when derivatives are up to date')
+
+    def handle(self, *args, **options):
+        generated = skipped = 0
+        for queryset, field_name in ((Product.objects.all(), 'images'), (ProductGallery.objects.all(), 'image')):
+            for instance in queryset.iterator():
+                if refresh_derivatives(instance, field_name, force=options['force']):
+                    generated += 1
+                else:
+                    skipped += 1
+        self.stdout.write(self.style.SUCCESS(f'Generated derivatives for {generated} image(s), skipped {skipped}.'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from store.ratings import find_drift, rebuild_ratings
+
+class Command(BaseCommand):
+    help = 'Rebuild the stored product rating aggregates from the reviews table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report drift, do not fix it')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            drift = find_drift()
+            for product, count, total, average in drift:
+                self.stdout.write(
+                    f'{product.product_name}: stored {product.rating_count}/{product.rating_average:.2f}, '
+                    f'actual {count}/{average:.2f}'
+                )
+            if drift:
+                raise CommandError(f'{len(drift)} product(s) have drifted rating aggregates.')
+            self.stdout.write(self.style.SUCCESS('Rating aggregates are in sync.'))
+            return
+
+        fixed = rebuild_ratings()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating aggregates for {fixed} product(s).'))
@@ -0,0 +1,52 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:40
+
+from django.db import migrations
+from django.db.utils import OperationalError
+
+FTS_TABLE = 'store_product_fts'
+PG_INDEX = 'store_product_search_idx'
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(product_name, description, tokenize='unicode61')"
+            )
+        except OperationalError:
+            # SQLite built without FTS5, search falls back to icontains
+            return
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, product_name, description) '
+            'SELECT id, product_name, description FROM store_product'
+        )
+    elif vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+        from django.contrib.postgres.search import SearchVector
+
+        Product = apps.get_model('store', 'Product')
+        schema_editor.add_index(Product, GinIndex(
+            SearchVector('product_name', weight='A', config='simple')
+            + SearchVector('description', weight='B', config='simple'),
+            name=PG_INDEX,
+        ))
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {PG_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_product_ratings'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
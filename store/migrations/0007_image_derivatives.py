@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_product_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='derivatives_of',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='productgallery',
+            name='derivatives_of',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:25
+
+from django.db import migrations, models
+from django.urls import reverse
+
+
+def backfill_url_path(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    products = list(Product.objects.select_related('category'))
+    for product in products:
+        product.url_path = reverse('product_detail', args=[product.category.slug, product.slug])
+    Product.objects.bulk_update(products, ['url_path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='url_path',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_url_path, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('category', '0002_alter_category_slug'),
+        ('store', '0008_product_url_path'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['category', 'id'], name='product_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['id'], name='product_available_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reviewrating',
+            index=models.Index(fields=['product', 'status'], name='review_product_status_idx'),
+        ),
+    ]
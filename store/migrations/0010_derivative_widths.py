@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-18 20:45
+
+from django.db import migrations, models
+
+
+def mark_derivatives_stale(apps, schema_editor):
+    # Derivatives are now named after the full source name and their real width,
+    # let generate_thumbnails make them again
+    for model_name in ('Product', 'ProductGallery'):
+        apps.get_model('store', model_name).objects.update(derivatives_of='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='derivative_widths',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='productgallery',
+            name='derivative_widths',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.RunPython(mark_derivatives_stale, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,27 @@
+import hashlib
 from django.db import models
 from category.models import Category
 from django.urls import reverse
 from accounts.models import Account
-from django.db.models import Avg, Count
+from django.db.models import Avg, Count, Q
 
 # Create your models here.
+class ProductQuerySet(models.QuerySet):
+    def with_ratings(self):
+        # Average and count of approved reviews in one GROUP BY
+        approved = Q(reviewrating__status=True)
+        return self.annotate(
+            review_average=Avg('reviewrating__rating', filter=approved),
+            review_count=Count('reviewrating', filter=approved),
+        )
+
+class ProductManager(models.Manager):
+    def get_queryset(self):
+        return ProductQuerySet(self.model, using=self._db)
+
+    def with_ratings(self):
+        return self.get_queryset().with_ratings()
+
 class Product(models.Model):
     product_name = models.CharField(max_length=200, unique=True)
     slug = models.SlugField(max_length=200, unique=True)
@@ -17,25 +34,59 @@ class Product(models.Model):
     created_date = models.DateTimeField(auto_now_add=True)
     modified_date = models.DateTimeField(auto_now=True)
 
-    def get_url(self):
+    # Rating aggregates, kept in sync by store.signals
+    rating_average = models.FloatField(default=0, editable=False)
+    rating_count = models.IntegerField(default=0, editable=False)
+    rating_sum = models.FloatField(default=0, editable=False)
+    # Canonical URL, refreshed on save and when the category slug changes
+    url_path = models.CharField(max_length=255, blank=True, editable=False)
+    # Name of the image the thumbnails in store.images were made from, and their widths
+    derivatives_of = models.CharField(max_length=255, blank=True, editable=False)
+    derivative_widths = models.JSONField(default=list, blank=True, editable=False)
+
+    objects = ProductManager()
+
+    class Meta:
+        indexes = [
+            # Store listings: available products, optionally of one category, in id order.
+            # Partial rather than leading with is_available, the ORM filters on the bare
+            # boolean column, which SQLite can only match against an index condition.
+            models.Index(fields=['category', 'id'], condition=Q(is_available=True), name='product_listing_idx'),
+            models.Index(fields=['id'], condition=Q(is_available=True), name='product_available_idx'),
+        ]
+
+    def build_url(self):
         return reverse('product_detail',args=[self.category.slug, self.slug])
 
+    def get_url(self):
+        # Stored path first, so listings don't load the category just to link
+        return self.url_path or self.build_url()
+
+    def save(self, *args, **kwargs):
+        self.url_path = self.build_url()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'url_path'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.product_name
     
+    def thumbnails_ready(self):
+        return bool(self.images) and self.derivatives_of == self.images.name
+
+    def thumbnail_widths(self):
+        return self.derivative_widths if self.thumbnails_ready() else []
+
     def averageReview(self):
-        reviews = ReviewRating.objects.filter(product=self, status=True).aggregate(average=Avg('rating'))
-        avg = 0
-        if reviews['average'] is not None:
-            avg = float(reviews['average'])
-        return avg
+        # Prefer the with_ratings() annotation when the queryset provided one
+        if hasattr(self, 'review_average'):
+            return float(self.review_average or 0)
+        return self.rating_average
     
     def CountReview(self):
-        reviews = ReviewRating.objects.filter(product=self, status=True).aggregate(count=Count('rating'))
-        count = 0
-        if reviews['count'] is not None:
-            count = int(reviews['count'])
-        return count
+        if hasattr(self, 'review_count'):
+            return int(self.review_count)
+        return self.rating_count
 
 class VariationManager(models.Manager):
     def colors(self):
@@ -61,6 +112,13 @@ class Variation(models.Model):
     def __str__(self):
         return self.variation_value
 
+def variation_signature(variations):
+    # Canonical key for a set of variations, the same whatever order they come in
+    ids = sorted({v if isinstance(v, int) else v.pk for v in variations})
+    if not ids:
+        return ''
+    return hashlib.sha1(','.join(map(str, ids)).encode()).hexdigest()
+
 class ReviewRating(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     user = models.ForeignKey(Account, on_delete=models.CASCADE)
@@ -72,12 +130,25 @@ class ReviewRating(models.Model):
     created_date = models.DateTimeField(auto_now_add=True)
     updated_date = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'status'], name='review_product_status_idx'),
+        ]
+
     def __str__(self):
         return self.subject
     
 class ProductGallery(models.Model):
     product = models.ForeignKey(Product, default=None, on_delete=models.CASCADE)
     image = models.ImageField(upload_to='store/products', max_length=255)
+    derivatives_of = models.CharField(max_length=255, blank=True, editable=False)
+    derivative_widths = models.JSONField(default=list, blank=True, editable=False)
+
+    def thumbnails_ready(self):
+        return bool(self.image) and self.derivatives_of == self.image.name
+
+    def thumbnail_widths(self):
+        return self.derivative_widths if self.thumbnails_ready() else []
 
     def __str__(self):
         return self.product.product_name
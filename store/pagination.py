@@ -0,0 +1,67 @@
+from django.core.cache import cache
+from django.utils.encoding import force_bytes, force_str
+from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
+from .models import Product
+
+# How long an approximate listing total may be served from cache
+PRODUCT_COUNT_TIMEOUT = 300
+
+class CursorPage:
+    # Just enough of Django's Page for store.html, walking forward with ?after=
+    cursor_mode = True
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+def encode_cursor(product_id):
+    return urlsafe_base64_encode(force_bytes(product_id))
+
+def decode_cursor(token):
+    # Unknown or tampered tokens start from the beginning
+    try:
+        return int(force_str(urlsafe_base64_decode(token)))
+    except (TypeError, ValueError):
+        return None
+
+def keyset_page(products, token, per_page):
+    # products must be ordered by id, the next page starts after the last id seen
+    after = decode_cursor(token)
+    if after is not None:
+        products = products.filter(id__gt=after)
+    rows = list(products[:per_page + 1])
+    next_cursor = encode_cursor(rows[per_page - 1].id) if len(rows) > per_page else None
+    return CursorPage(rows[:per_page], next_cursor)
+
+def product_count_key(category_id=None):
+    return f'store:product_count:{category_id or "all"}'
+
+def approximate_product_count(category=None):
+    # Available products in a listing, recounted at most every PRODUCT_COUNT_TIMEOUT
+    key = product_count_key(category.id if category else None)
+    count = cache.get(key)
+    if count is None:
+        products = Product.objects.filter(is_available=True)
+        if category is not None:
+            products = products.filter(category=category)
+        count = products.count()
+        cache.set(key, count, PRODUCT_COUNT_TIMEOUT)
+    return count
+
+def clear_product_counts(*category_ids):
+    cache.delete_many([product_count_key()] + [product_count_key(pk) for pk in category_ids])
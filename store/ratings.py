@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models import Case, When, F, FloatField, Sum, Q
+from .models import Product
+
+# Average derived from the stored sum and count
+RATING_AVERAGE = Case(
+    When(rating_count__gt=0, then=F('rating_sum') / F('rating_count')),
+    default=0.0,
+    output_field=FloatField(),
+)
+
+def apply_rating_delta(product_id, count, total):
+    # Shift the stored count and sum, then derive the average from them
+    with transaction.atomic():
+        products = Product.objects.filter(pk=product_id)
+        products.update(
+            rating_count=F('rating_count') + count,
+            rating_sum=F('rating_sum') + total,
+        )
+        products.update(rating_average=RATING_AVERAGE)
+
+def find_drift():
+    # Products whose stored aggregates disagree with the reviews table
+    products = Product.objects.with_ratings().annotate(
+        review_sum=Sum('reviewrating__rating', filter=Q(reviewrating__status=True)),
+    ).only('id', 'product_name', 'rating_count', 'rating_sum', 'rating_average')
+    drift = []
+    for product in products:
+        count, total = product.review_count, product.review_sum or 0
+        average = total / count if count else 0
+        if (product.rating_count != count
+                or abs(product.rating_sum - total) > 1e-6
+                or abs(product.rating_average - average) > 1e-6):
+            drift.append((product, count, total, average))
+    return drift
+
+def rebuild_ratings():
+    # Recompute every drifted product, returns the number of rows fixed
+    drift = find_drift()
+    with transaction.atomic():
+        for product, count, total, average in drift:
+            Product.objects.filter(pk=product.pk).update(
+                rating_count=count,
+                rating_sum=total,
+                rating_average=average,
+            )
+    return len(drift)
@@ -0,0 +1,125 @@
+import re
+from django.core.paginator import Paginator
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import Q
+from .models import Product
+
+# SQLite full-text index, rowid is the product id
+FTS_TABLE = 'store_product_fts'
+# Matches in the product name count ten times more than in the description
+FTS_WEIGHTS = '10.0, 1.0'
+
+# Per database alias. Only a final answer is kept: a missing table is looked up
+# again, so migrating a running process starts using the index without a restart.
+_fts_ready = {}
+
+def search_terms(keyword):
+    # Only plain words reach the MATCH expression, so user input can't break its syntax
+    return re.findall(r'\w+', keyword or '')
+
+def fts_available(using=DEFAULT_DB_ALIAS):
+    if using in _fts_ready:
+        return _fts_ready[using]
+    conn = connections[using]
+    if conn.vendor != 'sqlite':
+        _fts_ready[using] = False
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=%s", [FTS_TABLE])
+        if cursor.fetchone() is None:
+            return False
+    _fts_ready[using] = True
+    return True
+
+def index_product(product, using=DEFAULT_DB_ALIAS):
+    if not fts_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, product_name, description) VALUES (%s, %s, %s)',
+            [product.pk, product.product_name, product.description],
+        )
+
+def unindex_product(product_id, using=DEFAULT_DB_ALIAS):
+    if not fts_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+def _fts_match(terms):
+    # Every word must match, each one as a prefix
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def _fts_ids(terms, offset, limit):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'ORDER BY bm25({FTS_TABLE}, {FTS_WEIGHTS}) LIMIT %s OFFSET %s',
+            [_fts_match(terms), -1 if limit is None else limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+def _fts_count(terms):
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [_fts_match(terms)])
+        return cursor.fetchone()[0]
+
+def _postgres_products(terms):
+    from django.contrib.postgres.search import SearchQuery, SearchRank
+
+    query = SearchQuery(' & '.join(f'{term}:*' for term in terms), config='simple', search_type='raw')
+    products = Product.objects.annotate(search=search_vector()).filter(search=query)
+    return products.annotate(rank=SearchRank(search_vector(), query)).order_by('-rank', '-created_date')
+
+def search_vector():
+    # Must match the GIN index built by migration 0006 for PostgreSQL to use it
+    from django.contrib.postgres.search import SearchVector
+
+    return (
+        SearchVector('product_name', weight='A', config='simple')
+        + SearchVector('description', weight='B', config='simple')
+    )
+
+def _basic_products(terms):
+    query = Q()
+    for term in terms:
+        query &= Q(description__icontains=term) | Q(product_name__icontains=term)
+    return Product.objects.filter(query).order_by('-created_date')
+
+class SearchResults:
+    # Product ids matching keyword, best match first. Paginator only asks for the
+    # count and one slice, so each page is a LIMIT/OFFSET query plus a COUNT.
+    def __init__(self, keyword):
+        self.terms = search_terms(keyword)
+
+    def count(self):
+        if not self.terms:
+            return 0
+        if fts_available():
+            return _fts_count(self.terms)
+        if connection.vendor == 'postgresql':
+            return _postgres_products(self.terms).count()
+        return _basic_products(self.terms).count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError('SearchResults only supports slicing')
+        offset = index.start or 0
+        limit = None if index.stop is None else max(index.stop - offset, 0)
+        if not self.terms or limit == 0:
+            return []
+        if fts_available():
+            return _fts_ids(self.terms, offset, limit)
+        if connection.vendor == 'postgresql':
+            products = _postgres_products(self.terms)
+        else:
+            products = _basic_products(self.terms)
+        return list(products.values_list('id', flat=True)[index])
+
+def search_page(keyword, page_number, per_page=6):
+    paginator = Paginator(SearchResults(keyword), per_page)
+    page = paginator.get_page(page_number)
+    products = Product.objects.select_related('category').in_bulk(page.object_list)
+    page.object_list = [products[pk] for pk in page.object_list if pk in products]
+    return page
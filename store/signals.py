@@ -0,0 +1,73 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from category.models import Category
+from .models import Product, ReviewRating, ProductGallery, Variation
+from .ratings import apply_rating_delta
+from .search import index_product, unindex_product
+from .pagination import clear_product_counts
+from .images import refresh_derivatives
+from .variations import clear_variation_map
+
+@receiver(pre_save, sender=ReviewRating)
+def remember_review_rating(sender, instance, **kwargs):
+    # Keep the row as it was so post_save can work out the delta
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = ReviewRating.objects.filter(pk=instance.pk).values(
+            'product_id', 'rating', 'status'
+        ).first()
+
+@receiver(post_save, sender=ReviewRating)
+def update_product_rating(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+    if previous and previous['status']:
+        # Take the old rating back out
+        apply_rating_delta(previous['product_id'], -1, -previous['rating'])
+    if instance.status:
+        apply_rating_delta(instance.product_id, 1, instance.rating)
+
+@receiver(post_delete, sender=ReviewRating)
+def remove_product_rating(sender, instance, **kwargs):
+    if instance.status:
+        apply_rating_delta(instance.product_id, -1, -instance.rating)
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, using, **kwargs):
+    index_product(instance, using)
+    clear_product_counts(instance.category_id)
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, using, **kwargs):
+    unindex_product(instance.pk, using)
+    clear_product_counts(instance.category_id)
+
+@receiver(post_save, sender=Product)
+def update_product_thumbnails(sender, instance, **kwargs):
+    refresh_derivatives(instance, 'images')
+
+@receiver(post_save, sender=ProductGallery)
+def update_gallery_thumbnails(sender, instance, **kwargs):
+    refresh_derivatives(instance, 'image')
+
+@receiver(post_save, sender=Category)
+def update_product_urls(sender, instance, created, **kwargs):
+    if created:
+        return
+    changed = []
+    for product in Product.objects.filter(category=instance).only('id', 'slug', 'category', 'url_path'):
+        product.category = instance
+        url_path = product.build_url()
+        if product.url_path != url_path:
+            product.url_path = url_path
+            changed.append(product)
+    Product.objects.bulk_update(changed, ['url_path'], batch_size=500)
+
+@receiver(post_save, sender=Variation)
+@receiver(post_delete, sender=Variation)
+def invalidate_variation_map(sender, instance, **kwargs):
+    # Now for this transaction, and again once it commits in case another process
+    # cached the old rows in between
+    product_id = instance.product_id
+    clear_variation_map(product_id)
+    transaction.on_commit(lambda: clear_variation_map(product_id))
@@ -0,0 +1,25 @@
+from django import template
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+from store.fragments import render_product_cards
+from store.images import derivative_url, srcset
+
+register = template.Library()
+
+@register.simple_tag
+def product_cards(products, variant):
+    # {% product_cards products 'store' as cards %}, then loop over cards
+    return [mark_safe(html) for html in render_product_cards(products, variant)]
+
+@register.simple_tag
+def responsive_image(fieldfile, widths, sizes='300px', alt='', css_class=''):
+    # <picture> with WebP and JPEG thumbnails once they exist, the plain original until then.
+    # widths is the model's thumbnail_widths(), empty while there are none.
+    if not widths:
+        return format_html('<img src="{}" alt="{}" class="{}">', fieldfile.url, alt, css_class)
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy"></picture>',
+        srcset(fieldfile, widths, 'webp'), sizes,
+        derivative_url(fieldfile, widths[0], 'jpg'), srcset(fieldfile, widths, 'jpg'), sizes, alt, css_class,
+    )
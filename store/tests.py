@@ -1,3 +1,433 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest.mock import patch
+from PIL import Image
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from greatkart.testing import create_customer, without_session_timeout
+from category.models import Category
+from category.menu import MENU_VERSION_KEY
+from .fragments import card_cache_stats, reset_card_cache_stats
+from .images import THUMBNAIL_WIDTHS, derivative_name
+from .models import Product, ReviewRating, Variation
+from . import search
+from .search import FTS_TABLE, fts_available, search_page
 
 # Create your tests here.
+class ProductRatingTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(category_name='Shirts', slug='shirts')
+        self.user = create_customer()
+
+    def create_product(self, name):
+        return Product.objects.create(
+            product_name=name, slug=name, price=10, images='photos/products/test.jpg',
+            stock=5, category=self.category,
+        )
+
+    def create_review(self, product, rating, status=True):
+        return ReviewRating.objects.create(product=product, user=self.user, rating=rating, status=status)
+
+    def test_with_ratings_annotates_approved_reviews(self):
+        product = self.create_product('shirt')
+        self.create_review(product, 4)
+        self.create_review(product, 2)
+        self.create_review(product, 1, status=False)
+
+        product = Product.objects.with_ratings().get(pk=product.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(product.averageReview(), 3.0)
+            self.assertEqual(product.CountReview(), 2)
+
+    def test_with_ratings_without_reviews(self):
+        product = self.create_product('shirt')
+        product = Product.objects.with_ratings().get(pk=product.pk)
+        self.assertEqual(product.averageReview(), 0)
+        self.assertEqual(product.CountReview(), 0)
+
+    def page_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertQueriesConstant(self, url):
+        self.create_review(self.create_product('product-0'), 5)
+        # The first visits create and stamp the session, measure after that
+        self.client.get(url)
+        self.client.get(url)
+        one_product = self.page_queries(url)
+        for i in range(1, 8):
+            self.create_review(self.create_product(f'product-{i}'), 3)
+        self.assertEqual(self.page_queries(url), one_product)
+
+    @without_session_timeout
+    def test_store_query_count_does_not_grow_with_page_size(self):
+        self.assertQueriesConstant(reverse('store'))
+
+    @without_session_timeout
+    def test_home_query_count_does_not_grow_with_products(self):
+        self.assertQueriesConstant(reverse('home'))
+
+class RatingAggregateTest(TestCase):
+    def setUp(self):
+        category = Category.objects.create(category_name='Shirts', slug='shirts')
+        self.user = create_customer()
+        self.shirt, self.jacket = [
+            Product.objects.create(
+                product_name=name, slug=name, price=10, images='photos/products/test.jpg',
+                stock=5, category=category,
+            )
+            for name in ('shirt', 'jacket')
+        ]
+
+    def stored(self, product):
+        product.refresh_from_db()
+        return product.rating_count, product.rating_sum, product.rating_average
+
+    def test_create_and_edit(self):
+        review = ReviewRating.objects.create(product=self.shirt, user=self.user, rating=4)
+        ReviewRating.objects.create(product=self.shirt, user=self.user, rating=1, status=False)
+        self.assertEqual(self.stored(self.shirt), (1, 4, 4))
+        ReviewRating.objects.create(product=self.shirt, user=self.user, rating=2)
+        self.assertEqual(self.stored(self.shirt), (2, 6, 3))
+
+        review.rating = 5
+        review.save()
+        self.assertEqual(self.stored(self.shirt), (2, 7, 3.5))
+
+    def test_hide_and_delete(self):
+        review = ReviewRating.objects.create(product=self.shirt, user=self.user, rating=4)
+        ReviewRating.objects.create(product=self.shirt, user=self.user, rating=2)
+        review.status = False
+        review.save()
+        self.assertEqual(self.stored(self.shirt), (1, 2, 2))
+        review.status = True
+        review.save()
+        self.assertEqual(self.stored(self.shirt), (2, 6, 3))
+
+        review.delete()
+        self.assertEqual(self.stored(self.shirt), (1, 2, 2))
+        ReviewRating.objects.filter(product=self.shirt).get().delete()
+        self.assertEqual(self.stored(self.shirt), (0, 0, 0))
+
+    def test_move_to_another_product(self):
+        review = ReviewRating.objects.create(product=self.shirt, user=self.user, rating=4)
+        review.product = self.jacket
+        review.rating = 3
+        review.save()
+        self.assertEqual(self.stored(self.shirt), (0, 0, 0))
+        self.assertEqual(self.stored(self.jacket), (1, 3, 3))
+
+    def test_rebuild_ratings_fixes_drift(self):
+        ReviewRating.objects.create(product=self.shirt, user=self.user, rating=4)
+        call_command('rebuild_ratings', '--check', stdout=StringIO())
+
+        # Written behind the signals' back
+        ReviewRating.objects.update(rating=2)
+        Product.objects.filter(pk=self.jacket.pk).update(rating_count=3, rating_sum=9, rating_average=3)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_ratings', '--check', stdout=out)
+        self.assertIn('shirt: stored 1/4.00, actual 1/2.00', out.getvalue())
+
+        call_command('rebuild_ratings', stdout=StringIO())
+        self.assertEqual(self.stored(self.shirt), (1, 2, 2))
+        self.assertEqual(self.stored(self.jacket), (0, 0, 0))
+        call_command('rebuild_ratings', '--check', stdout=StringIO())
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(category_name='Shirts', slug='shirts')
+
+    def create_product(self, name, description=''):
+        return Product.objects.create(
+            product_name=name, slug=name.lower().replace(' ', '-'), description=description,
+            price=10, images='photos/products/test.jpg', stock=5, category=self.category,
+        )
+
+    def search(self, keyword, **params):
+        return self.client.get(reverse('search'), {'keyword': keyword, **params})
+
+    def test_name_matches_rank_first_and_prefixes_match(self):
+        in_description = self.create_product('Denim Jacket', 'Goes well with a blue shirt')
+        in_name = self.create_product('Blue Shirt')
+        response = self.search('shir')
+        self.assertEqual(list(response.context['products']), [in_name, in_description])
+        self.assertEqual(response.context['product_count'], 2)
+
+    def test_index_follows_product_changes(self):
+        product = self.create_product('Blue Shirt')
+        product.product_name = 'Red Jacket'
+        product.save()
+        self.assertEqual(self.search('shirt').context['product_count'], 0)
+        self.assertEqual(list(self.search('red jack').context['products']), [product])
+        product.delete()
+        self.assertEqual(self.search('jacket').context['product_count'], 0)
+
+    def test_empty_or_missing_keyword(self):
+        self.create_product('Blue Shirt')
+        for response in (self.search(''), self.search('"*'), self.client.get(reverse('search'))):
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['product_count'], 0)
+
+    def test_results_are_paginated(self):
+        for i in range(8):
+            self.create_product(f'Shirt {i}')
+        response = self.search('shirt', page=2)
+        self.assertEqual(response.context['product_count'], 8)
+        self.assertEqual(len(response.context['products']), 2)
+        self.assertContains(response, 'keyword=shirt&page=1')
+
+    def test_only_the_page_is_loaded(self):
+        for i in range(8):
+            self.create_product(f'Shirt {i}')
+        with CaptureQueriesContext(connection) as queries:
+            page = search_page('shirt', 2)
+        self.assertEqual((page.paginator.count, len(page)), (8, 2))
+        # One COUNT, and the ids of this page only
+        searches = [q['sql'] for q in queries if 'store_product' in q['sql'] and 'IN (' not in q['sql']]
+        self.assertEqual(len(searches), 2)
+        self.assertTrue(any('count(' in sql.lower() for sql in searches))
+        self.assertTrue(any('LIMIT 2 OFFSET 6' in sql or 'LIMIT 6, 2' in sql for sql in searches), searches)
+
+    def test_index_created_after_startup_is_picked_up(self):
+        self.addCleanup(search._fts_ready.clear)
+        product = self.create_product('Blue Shirt')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {FTS_TABLE}')
+        search._fts_ready.clear()
+        self.assertFalse(fts_available())
+        # Falls back to icontains meanwhile
+        self.assertEqual(list(self.search('shirt').context['products']), [product])
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(product_name, description)")
+        self.assertTrue(fts_available())
+
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(category_name='Shirts', slug='shirts')
+        self.products = [
+            Product.objects.create(
+                product_name=f'Shirt {i}', slug=f'shirt-{i}', price=10,
+                images='photos/products/test.jpg', stock=5, category=self.category,
+            )
+            for i in range(8)
+        ]
+
+    def walk(self, url, **params):
+        seen = []
+        after = ''
+        while after is not None:
+            response = self.client.get(url, {**params, 'after': after})
+            seen.extend(response.context['products'])
+            after = response.context['products'].next_cursor
+        return seen, response
+
+    def test_store_cursor_walks_every_product_once(self):
+        seen, response = self.walk(reverse('store'))
+        self.assertEqual(seen, self.products)
+        self.assertEqual(response.context['product_count'], 8)
+
+    def test_category_cursor_uses_category_page_size(self):
+        response = self.client.get(reverse('products_by_category', args=['shirts']), {'after': ''})
+        self.assertEqual(len(response.context['products']), 3)
+        self.assertContains(response, f'after={response.context["products"].next_cursor}')
+
+    def test_first_link_stays_in_cursor_mode(self):
+        after = self.client.get(reverse('store'), {'after': ''}).context['products'].next_cursor
+        self.assertContains(self.client.get(reverse('store'), {'after': after}), 'href="?after="')
+
+    def test_search_ignores_cursor(self):
+        response = self.client.get(reverse('search'), {'keyword': 'shirt', 'after': ''})
+        self.assertEqual(response.context['products'].number, 1)
+        self.assertContains(response, 'keyword=shirt&page=2')
+
+    def test_bad_cursor_starts_over(self):
+        response = self.client.get(reverse('store'), {'after': 'not-a-cursor'})
+        self.assertEqual(list(response.context['products']), self.products[:6])
+
+    def test_cached_count_is_cleared_on_product_change(self):
+        self.client.get(reverse('store'), {'after': ''})
+        self.products[0].is_available = False
+        self.products[0].save()
+        response = self.client.get(reverse('store'), {'after': ''})
+        self.assertEqual(response.context['product_count'], 7)
+
+class ProductCardCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_card_cache_stats()
+        self.category = Category.objects.create(category_name='Shirts', slug='shirts')
+        self.user = create_customer()
+        self.product = Product.objects.create(
+            product_name='Blue Shirt', slug='blue-shirt', price=10,
+            images='photos/products/test.jpg', stock=5, category=self.category,
+        )
+
+    def test_cards_are_served_from_cache(self):
+        self.client.get(reverse('store'))
+        self.client.get(reverse('store'))
+        self.assertEqual(card_cache_stats()['misses'], 1)
+        self.assertEqual(card_cache_stats()['hits'], 1)
+
+        out = StringIO()
+        call_command('card_cache_stats', '--reset', stdout=out)
+        self.assertIn('1 hit(s), 1 miss(es), hit ratio 50.0%', out.getvalue())
+        self.assertEqual(card_cache_stats()['hits'], 0)
+
+    def test_one_cache_read_for_all_cards(self):
+        for i in range(4):
+            Product.objects.create(
+                product_name=f'Shirt {i}', slug=f'shirt-{i}', price=10,
+                images='photos/products/test.jpg', stock=5, category=self.category,
+            )
+        self.client.get(reverse('store'))
+        with patch.object(cache, 'get', wraps=cache.get) as get, \
+                patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            self.client.get(reverse('store'))
+        self.assertEqual(get_many.call_count, 1)
+        self.assertEqual(len(get_many.call_args.args[0]), 5)
+        # The menu version is read for the navbar and once for all the cards
+        self.assertEqual([call.args[0] for call in get.call_args_list].count(MENU_VERSION_KEY), 2)
+
+    def test_product_and_review_changes_render_fresh_cards(self):
+        self.client.get(reverse('home'))
+        self.assertNotContains(self.client.get(reverse('home')), 'fa-star"')
+
+        ReviewRating.objects.create(product=self.product, user=self.user, rating=5)
+        self.assertContains(self.client.get(reverse('home')), 'fa-star"', count=5)
+
+        self.product.product_name = 'Red Shirt'
+        self.product.save()
+        self.assertContains(self.client.get(reverse('home')), 'Red Shirt')
+        self.assertEqual(card_cache_stats()['misses'], 3)
+
+    def test_category_slug_change_updates_card_urls(self):
+        self.client.get(reverse('store'))
+        self.category.slug = 'tops'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.save()
+        self.assertContains(self.client.get(reverse('store')), '/store/category/tops/blue-shirt/')
+
+class ProductDetailTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(category_name='Shirts', slug='shirts')
+        self.user = create_customer()
+        self.product = Product.objects.create(
+            product_name='Blue Shirt', slug='blue-shirt', price=10,
+            images='photos/products/test.jpg', stock=5, category=self.category,
+        )
+        Variation.objects.create(product=self.product, variation_category='color', variation_value='Blue')
+        Variation.objects.create(product=self.product, variation_category='size', variation_value='XL')
+        self.url = self.product.get_url()
+
+    def test_renders_variations_and_reviews(self):
+        ReviewRating.objects.create(product=self.product, user=self.user, subject='Great', rating=4)
+        response = self.client.get(self.url)
+        self.assertContains(response, 'value="blue"')
+        self.assertContains(response, 'value="xl"')
+        self.assertContains(response, 'John Doe')
+        self.assertContains(response, '1 Reviews')
+
+    def test_unchanged_page_is_not_modified(self):
+        response = self.client.get(self.url)
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_new_review_changes_etag(self):
+        etag = self.client.get(self.url).headers['ETag']
+        ReviewRating.objects.create(product=self.product, user=self.user, rating=4)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_rotated_csrf_token_changes_etag(self):
+        etag = self.client.get(self.url).headers['ETag']
+        # Logging in rotates the CSRF token the cached page's forms were rendered with
+        self.client.post(reverse('login'), {'email': 'john@example.com', 'password': 'secret'})
+        self.client.get(reverse('logout'))
+        # Shows the login and logout messages, a personal page without validators
+        self.assertNotIn('ETag', self.client.get(self.url).headers)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_logged_in_pages_are_not_conditional(self):
+        self.client.force_login(self.user)
+        self.assertNotIn('ETag', self.client.get(self.url).headers)
+
+class ImageDerivativeTest(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        override = override_settings(MEDIA_ROOT=media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.category = Category.objects.create(category_name='Shirts', slug='shirts')
+
+    def upload(self, name='shirt.png', size=(1200, 900), image_format='PNG'):
+        output = BytesIO()
+        Image.new('RGB', size, 'blue').save(output, image_format)
+        return SimpleUploadedFile(name, output.getvalue())
+
+    def create_product(self, slug, image):
+        return Product.objects.create(
+            product_name=slug, slug=slug, price=10, images=image, stock=5, category=self.category,
+        )
+
+    def test_upload_generates_thumbnails_and_webp(self):
+        product = self.create_product('blue-shirt', self.upload())
+        self.assertTrue(product.thumbnails_ready())
+        self.assertEqual(product.thumbnail_widths(), list(THUMBNAIL_WIDTHS))
+        storage = product.images.storage
+        for width in THUMBNAIL_WIDTHS:
+            for ext in ('jpg', 'webp'):
+                with Image.open(storage.path(derivative_name(product.images.name, width, ext))) as image:
+                    self.assertEqual(image.width, width)
+        self.assertContains(self.client.get(reverse('store')), 'type="image/webp"')
+
+    def test_sources_with_the_same_stem_keep_their_own_derivatives(self):
+        png = self.create_product('png-shirt', self.upload('shirt.png', (1200, 900)))
+        jpg = self.create_product('jpg-shirt', self.upload('shirt.jpg', (1200, 600), 'JPEG'))
+        storage = png.images.storage
+        for product, height in ((png, 225), (jpg, 150)):
+            with Image.open(storage.path(derivative_name(product.images.name, 300, 'webp'))) as image:
+                self.assertEqual(image.height, height)
+
+    def test_small_originals_are_not_upscaled(self):
+        product = self.create_product('small-shirt', self.upload(size=(250, 250)))
+        self.assertEqual(product.thumbnail_widths(), [250])
+        response = self.client.get(reverse('store'))
+        self.assertContains(response, f'{derivative_name(product.images.url, 250, "webp")} 250w')
+        self.assertNotContains(response, '300w')
+
+    def test_backfill_command(self):
+        product = self.create_product('blue-shirt', self.upload())
+        Product.objects.update(derivatives_of='')
+        call_command('generate_thumbnails', stdout=StringIO())
+        product.refresh_from_db()
+        self.assertTrue(product.thumbnails_ready())
+
+class ProductUrlTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(category_name='Shirts', slug='shirts')
+        self.product = Product.objects.create(
+            product_name='Blue Shirt', slug='blue-shirt', price=10,
+            images='photos/products/test.jpg', stock=5, category=self.category,
+        )
+
+    def test_get_url_does_not_load_category(self):
+        products = list(Product.objects.all())
+        with self.assertNumQueries(0):
+            self.assertEqual([p.get_url() for p in products], ['/store/category/shirts/blue-shirt/'])
+
+    def test_slug_changes_refresh_url(self):
+        self.product.slug = 'navy-shirt'
+        self.product.save(update_fields=['slug'])
+        self.category.slug = 'tops'
+        self.category.save()
+        self.assertEqual(Product.objects.get().get_url(), '/store/category/tops/navy-shirt/')
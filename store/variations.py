@@ -0,0 +1,43 @@
+from django.core.cache import cache
+from .models import Variation
+
+# Cached in the shared cache (see CACHES in settings) until a variation of the
+# product changes, see store.signals
+VARIATION_MAP_TIMEOUT = 60 * 60 * 24
+
+# Form fields posted alongside the variation choices
+IGNORED_FIELDS = ('csrfmiddlewaretoken',)
+
+class InvalidVariation(ValueError):
+    pass
+
+def variation_map_key(product_id):
+    return f'store:variations:{product_id}'
+
+def variation_map(product_id):
+    # {(category, value): variation id} for the product's active variations, lower-cased
+    key = variation_map_key(product_id)
+    variations = cache.get(key)
+    if variations is None:
+        rows = Variation.objects.filter(product_id=product_id, is_active=True).values_list(
+            'id', 'variation_category', 'variation_value'
+        )
+        variations = {(category.lower(), value.lower()): pk for pk, category, value in rows}
+        cache.set(key, variations, VARIATION_MAP_TIMEOUT)
+    return variations
+
+def clear_variation_map(product_id):
+    cache.delete(variation_map_key(product_id))
+
+def resolve_variations(product_id, data):
+    # Variation ids for every submitted (category, value) pair, all or nothing
+    variations = variation_map(product_id)
+    ids = []
+    for key, value in data.items():
+        if key in IGNORED_FIELDS:
+            continue
+        pk = variations.get((key.lower(), value.lower()))
+        if pk is None:
+            raise InvalidVariation(f'{key}: {value}')
+        ids.append(pk)
+    return ids
@@ -1,14 +1,20 @@
+import hashlib
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import Product, ReviewRating, ProductGallery
+from .models import Product, ReviewRating, Variation
 from category.models import Category
-from carts.views import _cart_id 
-from carts.models import CartItem
-from django.db.models import Q 
+from category.menu import menu_version
+from carts.context_processors import counter
 from .forms import ReviewForm
+from .search import search_page
+from .pagination import keyset_page, approximate_product_count
 from django.contrib import messages
 from orders.models import OrderProduct
 
 from django.core.paginator import Paginator
+from django.db.models import Max, Prefetch, prefetch_related_objects
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 
 # Create your views here.
 def store(request, category_slug=None):
@@ -19,19 +25,22 @@ def store(request, category_slug=None):
         # first find category
         categories = get_object_or_404(Category ,slug = category_slug)
         # Filter the products
-        products = Product.objects.filter(category=categories, is_available=True).order_by('id')
-        # apply pagination
-        paginator = Paginator(products, 3)
-        page = request.GET.get('page')
-        paged_products = paginator.get_page(page)
-        product_count = products.count()
+        products = Product.objects.filter(category=categories, is_available=True).select_related('category').order_by('id')
+        per_page = 3
+    else:
+        products = Product.objects.all().filter(is_available=True).select_related('category').order_by('id')
+        per_page = 6
 
+    if 'after' in request.GET:
+        # cursor mode: no OFFSET scan and a cached total instead of COUNT(*)
+        paged_products = keyset_page(products, request.GET['after'], per_page)
+        product_count = approximate_product_count(categories)
     else:
-        products = Product.objects.all().filter(is_available=True).order_by('id')
-        paginator = Paginator(products, 6)
+        # apply pagination
+        paginator = Paginator(products, per_page)
         page = request.GET.get('page')
         paged_products = paginator.get_page(page)
-        product_count = products.count()
+        product_count = paginator.count
 
     context = {
         'products': paged_products,
@@ -39,47 +48,75 @@ def store(request, category_slug=None):
     }
     return render(request,'store/store.html',context)
 
+def _product_validators(request, product):
+    # ETag and Last-Modified for anonymous visitors, None when the page is personal
+    if request.user.is_authenticated or len(messages.get_messages(request)):
+        return None
+    latest_review = ReviewRating.objects.filter(product=product).aggregate(latest=Max('updated_date'))['latest']
+    last_modified = max(filter(None, [product.modified_date, latest_review]))
+    # The page's forms carry a CSRF token: a cached copy is only valid with the same
+    # CSRF secret, a fresh one (no cookie yet, or rotated at login) never matches
+    get_token(request)
+    # The navbar also shows the menu and the visitor's cart badge
+    state = '{}:{}:{}:{}:{}:{}:{}'.format(
+        product.pk, product.modified_date.timestamp(), latest_review and latest_review.timestamp(),
+        product.rating_count, menu_version(), counter(request).get('cart_count'),
+        request.META['CSRF_COOKIE'],
+    )
+    return quote_etag(hashlib.md5(state.encode()).hexdigest()), last_modified
+
 def product_detail(request, category_slug, product_slug):
     # Using get_object_or_404 is cleaner and better for SEO/User Experience
-    try:
-        single_product = get_object_or_404(Product, category__slug=category_slug, slug=product_slug)
-        in_cart = CartItem.objects.filter(cart__cart_id=_cart_id(request), product=single_product).exists()
-    except Exception as e:
-        raise e 
-    
+    single_product = get_object_or_404(
+        Product.objects.select_related('category'), category__slug=category_slug, slug=product_slug
+    )
+
+    validators = _product_validators(request, single_product)
+    if validators is not None:
+        etag, last_modified = validators
+        not_modified = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+        if not_modified is not None:
+            not_modified.headers['ETag'] = etag
+            return not_modified
+
+    # One query each for the gallery, the approved reviews with their authors and the variations
+    prefetch_related_objects(
+        [single_product],
+        'productgallery_set',
+        Prefetch('reviewrating_set', queryset=ReviewRating.objects.filter(status=True).select_related('user'), to_attr='approved_reviews'),
+        Prefetch('variation_set', queryset=Variation.objects.filter(is_active=True), to_attr='active_variations'),
+    )
+
     if request.user.is_authenticated:
-        try:
-            orderproduct = OrderProduct.objects.filter(user=request.user, product_id=single_product.id).exists()
-        except OrderProduct.DoesNotExist:
-            orderproduct = None
+        orderproduct = OrderProduct.objects.filter(user=request.user, product_id=single_product.id).exists()
     else:
         orderproduct = None
 
-    # Get the reviews
-    reviews = ReviewRating.objects.filter(product_id=single_product.id, status=True)
-
-    # Get the product gallery
-    product_gallery = ProductGallery.objects.filter(product_id=single_product.id)
-
     context = {
         'single_product': single_product,
-        'in_cart': in_cart,
         'orderproduct': orderproduct,
-        'reviews': reviews,
-        'product_gallery': product_gallery,
+        'reviews': single_product.approved_reviews,
+        'product_gallery': single_product.productgallery_set.all(),
+        'colors': [v for v in single_product.active_variations if v.variation_category == 'color'],
+        'sizes': [v for v in single_product.active_variations if v.variation_category == 'size'],
     }
-    return render(request, 'store/product_detail.html', context)
+    response = render(request, 'store/product_detail.html', context)
+    if validators is not None:
+        response.headers['ETag'] = etag
+        response.headers['Last-Modified'] = http_date(last_modified.timestamp())
+        patch_cache_control(response, no_cache=True)
+    return response
 
 def search(request):
-    if 'keyword' in request.GET:
-        keyword = request.GET['keyword']
-        if keyword:
-            products = Product.objects.order_by('-created_date').filter(Q(description__icontains=keyword) | Q(product_name__icontains=keyword))
-            product_count = products.count()
-        context = {
-            'products':products,
-            'product_count':product_count,
-        }
+    keyword = request.GET.get('keyword', '').strip()
+    # Ranked results have no stable key to walk with ?after=, they are paged with
+    # LIMIT/OFFSET in the database instead
+    paged_products = search_page(keyword, request.GET.get('page'))
+    context = {
+        'products': paged_products,
+        'product_count': paged_products.paginator.count,
+        'keyword': keyword,
+    }
     return render(request,'store/store.html',context)
 
 def submit_review(request, product_id):